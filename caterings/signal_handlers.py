@@ -1,6 +1,10 @@
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from resources.response_cache import invalidate_reservation_data
 from resources.signals import reservation_modified, reservation_cancelled
 
+from .models import CateringOrder, CateringOrderLine
+
 
 @receiver(reservation_modified)
 def handle_reservation_change(sender, instance, user, **kwargs):
@@ -20,3 +24,12 @@ def handle_reservation_cancellation(sender, instance, user, **kwargs):
 
     for order in catering_orders:
         order.send_deleted_notification()
+
+
+@receiver(post_save, sender=CateringOrder, dispatch_uid='catering-order-reservation-data-save')
+@receiver(post_delete, sender=CateringOrder, dispatch_uid='catering-order-reservation-data-delete')
+@receiver(post_save, sender=CateringOrderLine, dispatch_uid='catering-order-line-reservation-data-save')
+@receiver(post_delete, sender=CateringOrderLine, dispatch_uid='catering-order-line-reservation-data-delete')
+def handle_catering_order_change(sender, **kwargs):
+    # Reservations show whether they have catering orders
+    invalidate_reservation_data()
@@ -18,7 +18,7 @@ from guardian import admin as guardian_admin
 from image_cropping import ImageCroppingMixin
 from modeltranslation.admin import TranslationAdmin, TranslationStackedInline
 from .base import ExtraReadonlyFieldsOnUpdateMixin, CommonExcludeMixin, PopulateCreatedAndModifiedMixin
-from resources.admin.period_inline import PeriodInline
+from resources.admin.period_inline import PeriodInline, get_changed_periods_date_range
 
 from ..models import (
     AccessibilityValue, AccessibilityViewpoint, Day, Equipment, EquipmentAlias, EquipmentCategory, Purpose,
@@ -112,7 +112,12 @@ class ResourceAdmin(PopulateCreatedAndModifiedMixin, CommonExcludeMixin, Transla
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        form.instance.update_opening_hours()
+        if not change or 'unit' in form.changed_data:
+            form.instance.update_opening_hours()
+            return
+        date_range = get_changed_periods_date_range(formsets)
+        if date_range:
+            form.instance.update_opening_hours(*date_range)
 
 
 class UnitAdmin(PopulateCreatedAndModifiedMixin, CommonExcludeMixin, FixedGuardedModelAdminMixin,
@@ -130,7 +135,12 @@ class UnitAdmin(PopulateCreatedAndModifiedMixin, CommonExcludeMixin, FixedGuarde
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        form.instance.update_opening_hours()
+        if not change or 'time_zone' in form.changed_data:
+            form.instance.update_opening_hours()
+            return
+        date_range = get_changed_periods_date_range(formsets)
+        if date_range:
+            form.instance.update_opening_hours(*date_range)
 
     def get_urls(self):
         urls = super(UnitAdmin, self).get_urls()
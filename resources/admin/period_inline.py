@@ -12,6 +12,30 @@ def prefix_weekday(weekday, name):
     return "%s%s-%s" % (WEEKDAY_PREFIX, weekday, name)
 
 
+def get_changed_periods_date_range(formsets):
+    """
+    Get the date range touched by added, changed or deleted periods in the given formsets.
+
+    Both the original and the new dates of changed periods are taken into account.
+
+    :return: (begin, end) tuple of dates, or None if no periods were changed
+    """
+    dates = []
+    for formset in formsets:
+        if formset.model is not Period:
+            continue
+        for form in formset.forms:
+            if not form.has_changed():
+                continue
+            cleaned_data = getattr(form, 'cleaned_data', {})
+            for data in (form.initial, cleaned_data):
+                if data.get("start") and data.get("end"):
+                    dates.extend((data["start"], data["end"]))
+    if not dates:
+        return None
+    return min(dates), max(dates)
+
+
 class DayFormlet(forms.ModelForm):
     class Meta:
         model = Day
@@ -1,5 +1,10 @@
+import calendar
+import hashlib
+
 from django.conf import settings
-from django.utils import timezone
+from django.utils import timezone, translation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 import django_filters
 from modeltranslation.translator import NotRegistered, translator
 from rest_framework import serializers
@@ -87,9 +92,53 @@ class DRFFilterBooleanWidget(django_filters.widgets.BooleanWidget):
         return None
 
 
+FIELDS_PARAMETER_NAME = 'fields'
+OMIT_PARAMETER_NAME = 'omit'
+
+
+def _parse_field_names(query_params, parameter_name):
+    names = set()
+    for value in query_params.getlist(parameter_name):
+        names.update(name.strip() for name in value.split(',') if name.strip())
+    return names
+
+
+def get_sparse_fieldset(query_params):
+    """
+    Get the field names given in the fields and omit query parameters
+
+    Returns the set of fields to show, or None if all of them are shown,
+    and the set of fields to leave out.
+
+    :rtype: tuple[set[str] | None, set[str]]
+    """
+    fields = _parse_field_names(query_params, FIELDS_PARAMETER_NAME) or None
+    return fields, _parse_field_names(query_params, OMIT_PARAMETER_NAME)
+
+
+def is_field_requested(query_params, field_name):
+    """
+    Check whether the field is shown according to the fields and omit query parameters
+
+    Views use this to skip preloading data for fields that are not shown.
+    """
+    return _is_in_fieldset(field_name, *get_sparse_fieldset(query_params))
+
+
+def _is_in_fieldset(field_name, fields, omit):
+    return (fields is None or field_name in fields) and field_name not in omit
+
+
 class ExtraDataMixin():
-    """ Mixin for serializers that provides conditionally included extra fields """
+    """
+    Mixin for serializers that provides conditionally included extra fields
+
+    The fields of the main serializer of a GET request can also be selected
+    with the fields and omit query parameters, each taking a comma separated
+    list of field names. Extra fields requested with include are always shown.
+    """
     INCLUDE_PARAMETER_NAME = 'include'
+    _sparse_fieldset = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -97,6 +146,11 @@ class ExtraDataMixin():
         if 'context' in kwargs and 'request' in kwargs['context']:
             request = kwargs['context']['request']
             includes = request.GET.getlist(self.INCLUDE_PARAMETER_NAME)
+            if self.is_sparse_fieldset_applicable(kwargs['context']):
+                self._sparse_fieldset = get_sparse_fieldset(request.GET)
+                for field_name in list(self.fields):
+                    if not self.is_field_shown(field_name):
+                        del self.fields[field_name]
             self.fields.update(self.get_extra_fields(includes, context=kwargs['context']))
 
     def get_extra_fields(self, includes, context):
@@ -110,3 +164,52 @@ class ExtraDataMixin():
             return fields
         """
         return {}
+
+    def is_sparse_fieldset_applicable(self, context):
+        """ Return whether the fields and omit query parameters select the fields of this serializer.
+        They only apply to the serializer of the view itself and not to nested serializers, and never to writes.
+        """
+        view = context.get('view')
+        if view is None or context['request'].method not in ('GET', 'HEAD'):
+            return False
+        return isinstance(self, view.get_serializer_class())
+
+    def is_field_shown(self, field_name):
+        """ Return whether the field is shown according to the fields and omit query parameters.
+        Also used for the data added in to_representation() without a serializer field.
+        """
+        if self._sparse_fieldset is None:
+            return True
+        return _is_in_fieldset(field_name, *self._sparse_fieldset)
+
+
+class ConditionalGetMixin():
+    """
+    Mixin for views that answer unchanged GET requests with 304 Not Modified
+
+    The view gives respond_conditionally() the latest modification time and a
+    fingerprint of the data the response is made of, see get_data_fingerprint().
+    The ETag also covers the request path, the user, the language, the format
+    and the current date, which the responses vary by. Deleted rows do not show
+    in the modification time, so only the ETag is used to decide whether the
+    response has changed. Without a fingerprint the response is made as usual.
+    """
+    def respond_conditionally(self, request, last_modified, fingerprint, get_response):
+        if fingerprint is None:
+            return get_response()
+        etag_source = repr((
+            fingerprint, request.get_full_path(), getattr(request.user, 'pk', None), translation.get_language(),
+            request.accepted_renderer.format, timezone.now().date(),
+        ))
+        etag = quote_etag(hashlib.md5(etag_source.encode('utf8')).hexdigest())
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        response = get_response()
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(calendar.timegm(last_modified.utctimetuple()))
+        return response
@@ -1,4 +1,7 @@
+import csv
+import io
 import uuid
+from contextlib import contextmanager
 import arrow
 import django_filters
 from arrow.parser import ParserError
@@ -8,7 +11,9 @@ from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import (
     PermissionDenied, ValidationError as DjangoValidationError
 )
+from django.db import IntegrityError, transaction
 from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, serializers, filters, exceptions, permissions
@@ -16,17 +21,25 @@ from rest_framework.authentication import TokenAuthentication, SessionAuthentica
 from rest_framework.fields import BooleanField, IntegerField
 from rest_framework import renderers
 from rest_framework.exceptions import NotAcceptable, ValidationError
+from rest_framework.response import Response
 from rest_framework.settings import api_settings as drf_settings
 
 from munigeo import api as munigeo_api
-from resources.models import Reservation, Resource, ReservationMetadataSet
-from resources.models.reservation import RESERVATION_EXTRA_FIELDS
+from resources.models import Reservation, Resource
+from resources.models.lookup_cache import get_reservation_metadata_sets
+from resources.models.reservation import RESERVATION_EXTRA_FIELDS, is_reservation_overlap_error
+from resources.models.resource import load_reservation_validation_data
 from resources.pagination import ReservationPagination
-from resources.models.utils import generate_reservation_xlsx, get_object_or_none
+from resources.response_cache import get_data_fingerprint
+from resources.models.utils import (
+    generate_reservation_csv, generate_reservation_ndjson, generate_reservation_xlsx, generate_reservation_xlsx_file,
+    get_object_or_none
+)
 
 from ..auth import is_general_admin
 from .base import (
-    NullableDateTimeField, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget
+    ConditionalGetMixin, ExtraDataMixin, NullableDateTimeField, TranslatedModelSerializer, register_view,
+    DRFFilterBooleanWidget
 )
 
 User = get_user_model()
@@ -63,7 +76,7 @@ class UserSerializer(TranslatedModelSerializer):
         fields = ('id', 'display_name', 'email')
 
 
-class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
+class ReservationSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
     begin = NullableDateTimeField()
     end = NullableDateTimeField()
     user = UserSerializer(required=False)
@@ -79,6 +92,8 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
             'staff_event', 'access_code', 'user_permissions'
         ] + list(RESERVATION_EXTRA_FIELDS)
         read_only_fields = RESERVATION_EXTRA_FIELDS
+        # The unit is needed in validation
+        extra_kwargs = {'resource': {'queryset': Resource.objects.select_related('unit')}}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -110,10 +125,19 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
             # we don't need to remove a field here if it isn't supported, as it will be read-only and will be more
             # easily removed in to_representation()
             for field_name in supported:
-                self.fields[field_name].read_only = False
+                if field_name in self.fields:
+                    self.fields[field_name].read_only = False
 
             for field_name in required:
-                self.fields[field_name].required = True
+                if field_name in self.fields:
+                    self.fields[field_name].required = True
+
+    def is_sparse_fieldset_applicable(self, context):
+        # the Excel export needs all the fields
+        renderer = getattr(context['request'], 'accepted_renderer', None)
+        if renderer is not None and renderer.format == 'xlsx':
+            return False
+        return super().is_sparse_fieldset_applicable(context)
 
     def validate_state(self, value):
         instance = self.instance
@@ -144,6 +168,10 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
         except KeyError:
             resource = reservation.resource
 
+        # Fetch what the validators below and Reservation.clean() need at once. The opening hours are
+        # memoized in the resource, as several validators need them.
+        load_reservation_validation_data(resource, request_user, data['begin'], data['end'], reservation)
+
         if not resource.can_make_reservations(request_user):
             raise PermissionDenied(_('You are not allowed to make reservations in this resource.'))
 
@@ -190,15 +218,14 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
             if access_code_enabled and reservation and data['access_code'] != reservation.access_code:
                 raise ValidationError(dict(access_code=_('This field cannot be changed')))
 
-        # Mark begin of a critical section. Subsequent calls with this same resource will block here until the first
-        # request is finished. This is needed so that the validations and possible reservation saving are
-        # executed in one block and concurrent requests cannot be validated incorrectly.
-        Resource.objects.select_for_update().get(pk=resource.pk)
-
         # Check maximum number of active reservations per user per resource.
         # Only new reservations are taken into account ie. a normal user can modify an existing reservation
         # even if it exceeds the limit. (one that was created via admin ui for example).
-        if reservation is None:
+        if reservation is None and resource.max_reservations_per_user is not None:
+            # Mark begin of a critical section. Subsequent calls with this same resource will block here until
+            # the first request is finished, so that concurrent requests cannot exceed the limit. Overlapping
+            # reservations need no lock, as the database refuses them when they are saved.
+            Resource.objects.select_for_update().get(pk=resource.pk)
             resource.validate_max_reservations_per_user(request_user)
 
         # Run model clean
@@ -255,8 +282,8 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
 
         # Show the comments field and the user object only for staff
         if not resource.is_admin(user):
-            del data['comments']
-            del data['user']
+            data.pop('comments', None)
+            data.pop('user', None)
 
         if instance.are_extra_fields_visible(user):
             cache = self.context.get('reservation_metadata_set_cache')
@@ -269,12 +296,12 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
                 data.pop(field_name, None)
 
         if not (resource.is_access_code_enabled() and instance.can_view_access_code(user)):
-            data.pop('access_code')
+            data.pop('access_code', None)
 
         if 'access_code' in data and data['access_code'] == '':
             data['access_code'] = None
 
-        if instance.can_view_catering_orders(user):
+        if self.is_field_shown('has_catering_order') and instance.can_view_catering_orders(user):
             data['has_catering_order'] = instance.catering_orders.exists()
 
         return data
@@ -467,6 +494,98 @@ class ReservationExcelRenderer(renderers.BaseRenderer):
             return NotAcceptable()
 
 
+class ReservationCSVRenderer(renderers.BaseRenderer):
+    """
+    CSV format of reservations
+
+    Reservations are streamed by ReservationViewSet without the renderer,
+    which only renders the rest of the responses, such as errors.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        if not isinstance(data, dict):
+            return bytes()
+        writer_output = io.StringIO()
+        writer = csv.DictWriter(writer_output, list(data))
+        writer.writeheader()
+        writer.writerow(data)
+        return writer_output.getvalue().encode(self.charset)
+
+
+class ReservationNDJSONRenderer(renderers.JSONRenderer):
+    """
+    Newline delimited JSON format of reservations
+
+    As with ReservationCSVRenderer, reservations are streamed by ReservationViewSet.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(data, accepted_media_type, renderer_context) + b'\n'
+
+
+# Formats that ReservationViewSet streams reservations in
+STREAMING_EXPORT_FORMATS = {
+    ReservationCSVRenderer.format: (ReservationCSVRenderer.media_type, generate_reservation_csv),
+    ReservationNDJSONRenderer.format: (ReservationNDJSONRenderer.media_type, generate_reservation_ndjson),
+}
+
+# Number of reservations fetched at a time when exporting
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_reservation_export_rows(queryset, user):
+    """
+    Iterate the reservations of the queryset as dicts for exporting
+
+    The dicts have the fields expected by generate_reservation_xlsx(), and
+    what they show follows ReservationSerializer.to_representation(). The
+    reservations are fetched in chunks and the permissions are checked once
+    per resource, so exports of any size take bounded memory.
+
+    :type queryset: django.db.models.QuerySet
+    :type user: users.models.User
+    """
+    queryset = queryset.select_related('resource__unit', 'user').prefetch_related(None)
+    checker = ObjectPermissionChecker(user)
+    metadata_sets = get_reservation_metadata_sets()
+    resource_permissions = {}
+
+    for reservation in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        resource = reservation.resource
+        resource._permission_checker = checker
+        if resource.id not in resource_permissions:
+            resource_permissions[resource.id] = (
+                resource.is_admin(user),
+                resource.can_view_reservation_extra_fields(user),
+                set(resource.get_supported_reservation_extra_field_names(cache=metadata_sets)),
+            )
+        is_admin, can_view_extra_fields, supported_fields = resource_permissions[resource.id]
+
+        row = {
+            'id': reservation.id,
+            'unit': resource.unit.name if resource.unit else '',
+            'resource': resource.name,
+            'begin': reservation.begin,
+            'end': reservation.end,
+            'created_at': reservation.created_at,
+            'state': reservation.state,
+            'staff_event': reservation.staff_event,
+        }
+        if is_admin:
+            row['user'] = reservation.user.email if reservation.user else ''
+            row['comments'] = reservation.comments
+        if can_view_extra_fields or reservation.is_own(user):
+            for field_name in RESERVATION_EXTRA_FIELDS:
+                if field_name in supported_fields:
+                    row[field_name] = getattr(reservation, field_name)
+        yield row
+
+
 class ReservationCacheMixin:
     def _preload_permissions(self):
         units = set()
@@ -490,14 +609,14 @@ class ReservationCacheMixin:
 
     def _get_cache_context(self):
         context = {}
-        set_list = ReservationMetadataSet.objects.all().prefetch_related('supported_fields', 'required_fields')
-        context['reservation_metadata_set_cache'] = {x.id: x for x in set_list}
+        context['reservation_metadata_set_cache'] = get_reservation_metadata_sets()
 
         self._preload_permissions()
         return context
 
 
-class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, ReservationCacheMixin):
+class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, ReservationCacheMixin,
+                         ConditionalGetMixin):
     queryset = Reservation.objects.select_related('user', 'resource', 'resource__unit')\
         .prefetch_related('catering_orders').prefetch_related('resource__groups').order_by('begin', 'resource__unit__name', 'resource__name')
 
@@ -506,7 +625,8 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
                        NeedManualConfirmationFilterBackend, StateFilterBackend, CanApproveFilterBackend)
     filterset_class = ReservationFilterSet
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, ReservationPermission)
-    renderer_classes = (renderers.JSONRenderer, renderers.BrowsableAPIRenderer, ReservationExcelRenderer)
+    renderer_classes = (renderers.JSONRenderer, renderers.BrowsableAPIRenderer, ReservationExcelRenderer,
+                        ReservationCSVRenderer, ReservationNDJSONRenderer)
     pagination_class = ReservationPagination
     authentication_classes = (
         list(drf_settings.DEFAULT_AUTHENTICATION_CLASSES) +
@@ -548,13 +668,24 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
 
         return queryset
 
+    @contextmanager
+    def _check_overlap(self):
+        # Concurrent requests may both pass validation, but only one of them can save its reservation
+        try:
+            with transaction.atomic():
+                yield
+        except IntegrityError as exc:
+            if not is_reservation_overlap_error(exc):
+                raise
+            raise ValidationError({
+                drf_settings.NON_FIELD_ERRORS_KEY: [_('The resource is already reserved for some of the period')]
+            })
+
     def perform_create(self, serializer):
         override_data = {'created_by': self.request.user, 'modified_by': self.request.user}
         if 'user' not in serializer.validated_data:
             override_data['user'] = self.request.user
         override_data['state'] = Reservation.CREATED
-        instance = serializer.save(**override_data)
-
         resource = serializer.validated_data['resource']
         is_resource_manager = resource.is_manager(self.request.user)
         if resource.need_manual_confirmation and not is_resource_manager:
@@ -562,28 +693,66 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
         else:
             new_state = Reservation.CONFIRMED
 
-        instance.set_state(new_state, self.request.user)
+        with self._check_overlap():
+            instance = serializer.save(**override_data)
+            instance.set_state(new_state, self.request.user)
 
     def perform_update(self, serializer):
         old_instance = self.get_object()
         new_state = serializer.validated_data.pop('state', old_instance.state)
-        new_instance = serializer.save(modified_by=self.request.user)
-        new_instance.set_state(new_state, self.request.user)
+        with self._check_overlap():
+            new_instance = serializer.save(modified_by=self.request.user)
+            new_instance.set_state(new_state, self.request.user)
 
     def perform_destroy(self, instance):
         instance.set_state(Reservation.CANCELLED, self.request.user)
 
-    def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = 'attachment; filename={}.xlsx'.format(_('reservations'))
+    def _get_excel_response(self):
+        # The workbook is built before the response is sent, so the export is a page of at most
+        # ReservationPagination.export_max_page_size reservations
+        queryset = self.paginator.get_export_page(self.filter_queryset(self.get_queryset()), self.request)
+        rows = iter_reservation_export_rows(queryset, self.request.user)
+        response = FileResponse(generate_reservation_xlsx_file(rows), content_type=ReservationExcelRenderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename={}.xlsx'.format(_('reservations'))
         return response
 
-    def retrieve(self, request, *args, **kwargs):
-        response = super().retrieve(request, *args, **kwargs)
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = 'attachment; filename={}-{}.xlsx'.format(_('reservation'), kwargs['pk'])
+    def _get_streaming_response(self, queryset, filename):
+        # The rows are fetched and formatted only as the response is sent
+        content_type, generate = STREAMING_EXPORT_FORMATS[self.request.accepted_renderer.format]
+        rows = iter_reservation_export_rows(queryset, self.request.user)
+        response = StreamingHttpResponse(generate(rows), content_type='{}; charset=utf-8'.format(content_type))
+        if self.request.accepted_renderer.format == ReservationCSVRenderer.format:
+            response['Content-Disposition'] = 'attachment; filename={}.csv'.format(filename)
         return response
 
+    def list(self, request, *args, **kwargs):
+        def get_response():
+            if request.accepted_renderer.format == 'xlsx':
+                return self._get_excel_response()
+            if request.accepted_renderer.format in STREAMING_EXPORT_FORMATS:
+                # All the matching reservations are streamed without pagination
+                return self._get_streaming_response(self.filter_queryset(self.get_queryset()), _('reservations'))
+            return super(ReservationViewSet, self).list(request, *args, **kwargs)
+
+        return self.respond_conditionally(request, None, get_data_fingerprint(), get_response)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        fingerprint = get_data_fingerprint()
+
+        def get_response():
+            if request.accepted_renderer.format in STREAMING_EXPORT_FORMATS:
+                return self._get_streaming_response(
+                    Reservation.objects.filter(pk=instance.pk), '{}-{}'.format(_('reservation'), instance.pk)
+                )
+            response = Response(self.get_serializer(instance).data)
+            if request.accepted_renderer.format == 'xlsx':
+                response['Content-Disposition'] = 'attachment; filename={}-{}.xlsx'.format(
+                    _('reservation'), kwargs['pk']
+                )
+            return response
+
+        return self.respond_conditionally(request, instance.modified_at, fingerprint, get_response)
+
 
 register_view(ReservationViewSet, 'reservation')
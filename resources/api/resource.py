@@ -1,18 +1,24 @@
 import collections
 import datetime
 import logging
+import re
 
 import arrow
 import django_filters
-import pytz
 from arrow.parser import ParserError
 
 from django import forms
-from django.db.models import OuterRef, Prefetch, Q, Subquery, Value
-from django.db.models.functions import Coalesce, Least
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQueryCombinable, SearchQueryField, SearchRank
+from django.db.models import BooleanField, Exists, F, Func, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Least
 from django.urls import reverse
+from django.utils import timezone
+from django.contrib.gis.db.models import PointField
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db.models.expressions import RawSQL
 from resources.pagination import PurposePagination
 from rest_framework import exceptions, filters, mixins, serializers, viewsets, response, status
 from rest_framework.authentication import SessionAuthentication
@@ -21,15 +27,25 @@ from guardian.core import ObjectPermissionChecker
 
 from munigeo import api as munigeo_api
 from resources.models import (
-    AccessibilityValue, AccessibilityViewpoint, Purpose, Reservation, Resource, ResourceAccessibility,
-    ResourceImage, ResourceType, ResourceEquipment, TermsOfUse, Equipment, ReservationMetadataSet,
+    AccessibilityValue, Purpose, Reservation, Resource, ResourceAccessibility,
+    ResourceImage, ResourceType, ResourceEquipment, TermsOfUse, Equipment,
     ResourceDailyOpeningHours, UnitAccessibility
 )
-from resources.models.resource import determine_hours_time_range
+from resources.models.lookup_cache import get_accessibility_viewpoints, get_reservation_metadata_sets
+from resources.models.resource import (
+    SEARCH_CONFIGS, determine_hours_time_range, get_available_hours_for_resources, get_earliest_free_slots
+)
+from resources.models.utils import get_tz
+from resources.response_cache import (
+    get_cached_resource_list, get_data_fingerprint, get_resource_list_cache_key, set_cached_resource_list
+)
 
 from ..auth import is_general_admin, is_staff
 from .accessibility import ResourceAccessibilitySerializer
-from .base import ExtraDataMixin, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget
+from .base import (
+    ConditionalGetMixin, ExtraDataMixin, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget,
+    is_field_requested
+)
 from .reservation import ReservationSerializer
 from .unit import UnitSerializer
 from .equipment import EquipmentSerializer
@@ -38,6 +54,13 @@ from rest_framework.settings import api_settings as drf_settings
 
 logger = logging.getLogger(__name__)
 
+# Defaults and maximums for the number of days to search and the number of
+# slots to return in the available_slots endpoint
+AVAILABLE_SLOTS_DEFAULT_HORIZON = 7
+AVAILABLE_SLOTS_MAX_HORIZON = 90
+AVAILABLE_SLOTS_DEFAULT_LIMIT = 10
+AVAILABLE_SLOTS_MAX_LIMIT = 100
+
 
 def parse_query_time_range(params):
     times = {}
@@ -58,6 +81,57 @@ def parse_query_time_range(params):
     return times
 
 
+def parse_query_availability_options(params):
+    options = {}
+    if 'duration' in params:
+        try:
+            options['duration'] = int(params['duration'])
+        except ValueError:
+            raise exceptions.ParseError("'duration' must be supplied as an integer")
+
+    if 'during_closing' in params:
+        during_closing = params['during_closing'].lower()
+        if during_closing == 'true' or during_closing == 'yes' or during_closing == '1':
+            options['during_closing'] = True
+
+    return options
+
+
+def parse_query_available_slots_options(params):
+    options = parse_query_availability_options(params)
+    if not options.get('duration') or options['duration'] <= 0:
+        raise exceptions.ParseError("'duration' must be supplied as a positive integer")
+
+    now = timezone.now()
+    if 'start' in params:
+        try:
+            options['start'] = max(arrow.get(params['start']).to('utc').datetime, now)
+        except ParserError:
+            raise exceptions.ParseError("'start' must be a timestamp in ISO 8601 format")
+    else:
+        options['start'] = now
+
+    for name, default, maximum in (('horizon', AVAILABLE_SLOTS_DEFAULT_HORIZON, AVAILABLE_SLOTS_MAX_HORIZON),
+                                   ('limit', AVAILABLE_SLOTS_DEFAULT_LIMIT, AVAILABLE_SLOTS_MAX_LIMIT)):
+        try:
+            value = int(params.get(name, default))
+        except ValueError:
+            raise exceptions.ParseError("'%s' must be supplied as an integer" % name)
+        if not 0 < value <= maximum:
+            raise exceptions.ParseError("'%s' must be between 1 and %d" % (name, maximum))
+        options[name] = value
+
+    return options
+
+
+def get_available_hours_kwargs(options):
+    duration = options.get('duration')
+    return {
+        'duration': datetime.timedelta(minutes=duration) if duration else None,
+        'during_closing': options.get('during_closing', False),
+    }
+
+
 def get_resource_reservations_queryset(begin, end):
     qs = Reservation.objects.filter(begin__lte=end, end__gte=begin).current()
     qs = qs.order_by('begin').prefetch_related('catering_orders').select_related('user')
@@ -156,8 +230,7 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
     type = ResourceTypeSerializer()
     # FIXME: location field gets removed by munigeo
     location = serializers.SerializerMethodField()
-    # FIXME: Enable available_hours when it's more performant
-    # available_hours = serializers.SerializerMethodField()
+    available_hours = serializers.SerializerMethodField()
     opening_hours = serializers.SerializerMethodField()
     reservations = serializers.SerializerMethodField()
     user_permissions = serializers.SerializerMethodField()
@@ -188,7 +261,7 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
         if 'accessibility_viewpoint_cache' in self.context:
             accessibility_viewpoints = self.context['accessibility_viewpoint_cache']
         else:
-            accessibility_viewpoints = AccessibilityViewpoint.objects.all()
+            accessibility_viewpoints = get_accessibility_viewpoints()
         summaries_by_viewpoint = {acc_s.viewpoint_id: acc_s for acc_s in obj.accessibility_summaries.all()}
         summaries = [
             summaries_by_viewpoint.get(
@@ -207,8 +280,12 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
         }
 
     def get_is_favorite(self, obj):
+        if hasattr(obj, 'user_is_favorite'):
+            return obj.user_is_favorite
         request = self.context.get('request', None)
-        return request.user in obj.favorited_by.all()
+        if request is None or not request.user.is_authenticated:
+            return False
+        return obj.favorited_by.filter(pk=request.user.pk).exists()
 
     def get_generic_terms(self, obj):
         data = TermsOfUseSerializer(obj.generic_terms).data
@@ -245,11 +322,8 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
             if set_id:
                 obj.reservation_metadata_set = self.context['reservation_metadata_set_cache'][set_id]
         ret = super().to_representation(obj)
-        if hasattr(obj, 'distance'):
-            if obj.distance is not None:
-                ret['distance'] = int(obj.distance.m)
-            elif obj.unit_distance is not None:
-                ret['distance'] = int(obj.unit_distance.m)
+        if getattr(obj, 'distance', None) is not None and self.is_field_shown('distance'):
+            ret['distance'] = int(obj.distance.m)
 
         return ret
 
@@ -266,17 +340,7 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
 
         params = self.context['request'].query_params
         times = parse_query_time_range(params)
-
-        if 'duration' in params:
-            try:
-                times['duration'] = int(params['duration'])
-            except ValueError:
-                raise exceptions.ParseError("'duration' must be supplied as an integer")
-
-        if 'during_closing' in params:
-            during_closing = params['during_closing'].lower()
-            if during_closing == 'true' or during_closing == 'yes' or during_closing == '1':
-                times['during_closing'] = True
+        times.update(parse_query_availability_options(params))
 
         if len(times):
             self.context.update(times)
@@ -300,6 +364,16 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
             ret.append(d)
         return ret
 
+    def get_available_hours(self, obj):
+        if 'start' not in self.context:
+            return None
+
+        if 'available_hours_cache' in self.context:
+            return self.context['available_hours_cache'].get(obj.id, [])
+
+        return obj.get_available_hours(self.context['start'], self.context['end'],
+                                       **get_available_hours_kwargs(self.context))
+
     def get_reservations(self, obj):
         if 'start' not in self.context:
             return None
@@ -318,7 +392,8 @@ class ResourceSerializer(ExtraDataMixin, TranslatedModelSerializer, munigeo_api.
     class Meta:
         model = Resource
         exclude = ('reservation_requested_notification_extra', 'reservation_confirmed_notification_extra',
-                   'access_code_type', 'reservation_metadata_set')
+                   'access_code_type', 'reservation_metadata_set', 'search_document',
+                   'effective_location')
 
 
 class ResourceDetailsSerializer(ResourceSerializer):
@@ -349,10 +424,11 @@ class ResourceOrderingFilter(django_filters.OrderingFilter):
     def filter(self, qs, value):
         if value and ('accessibility' in value or '-accessibility' in value):
             viewpoint_id = self.parent.data.get('accessibility_viewpoint')
-            try:
-                accessibility_viewpoint = AccessibilityViewpoint.objects.get(id=viewpoint_id)
-            except AccessibilityViewpoint.DoesNotExist:
-                accessibility_viewpoint = AccessibilityViewpoint.objects.first()
+            accessibility_viewpoints = get_accessibility_viewpoints()
+            accessibility_viewpoint = next(
+                (viewpoint for viewpoint in accessibility_viewpoints if viewpoint.id == viewpoint_id),
+                accessibility_viewpoints[0] if accessibility_viewpoints else None
+            )
             if accessibility_viewpoint is None:
                 logging.error('Accessibility Viewpoints are not imported from Accessibility database')
                 value = [val for val in value if val != 'accessibility' and val != '-accessibility']
@@ -448,118 +524,31 @@ class ResourceFilterSet(django_filters.FilterSet):
 
         if available_start.date() != available_end.date():
             raise exceptions.ParseError('available_between timestamps must be on the same day.')
-        overlapping_reservations = Reservation.objects.filter(
-            resource__in=queryset, end__gt=available_start, begin__lt=available_end
-        ).current()
 
         if len(value) == 2:
-            return self._filter_available_between_whole_range(
-                queryset, overlapping_reservations, available_start, available_end
-            )
+            return self._filter_available_between_whole_range(queryset, available_start, available_end)
         else:
             try:
                 period = datetime.timedelta(minutes=int(value[2]))
             except ValueError:
                 raise exceptions.ParseError('available_between period must be an integer.')
-            return self._filter_available_between_with_period(
-                queryset, overlapping_reservations, available_start, available_end, period
-            )
+            return self._filter_available_between_with_period(queryset, available_start, available_end, period)
 
-    def _filter_available_between_whole_range(self, queryset, reservations, available_start, available_end):
+    def _filter_available_between_whole_range(self, queryset, available_start, available_end):
         # exclude resources that have reservation(s) overlapping with the available_between range
-        queryset = queryset.exclude(reservations__in=reservations)
-        closed_resource_ids = {
-            resource.id
-            for resource in queryset
-            if not self._is_resource_open(resource, available_start, available_end)
-        }
-
-        return queryset.exclude(id__in=closed_resource_ids)
-
-    @staticmethod
-    def _is_resource_open(resource, start, end):
-        opening_hours = resource.get_opening_hours(start, end)
-        if len(opening_hours) > 1:
-            # range spans over multiple days, assume resources aren't open all night and skip the resource
-            return False
-
-        hours = next(iter(opening_hours.values()))[0]  # assume there is only one hours obj per day
-        if not hours['opens'] and not hours['closes']:
-            return False
-
-        start_too_early = hours['opens'] and start < hours['opens']
-        end_too_late = hours['closes'] and end > hours['closes']
-        if start_too_early or end_too_late:
-            return False
-
-        return True
-
-    def _filter_available_between_with_period(self, queryset, reservations, available_start, available_end, period):
-        reservations = reservations.order_by('begin').select_related('resource')
-
-        reservations_by_resource = collections.defaultdict(list)
-        for reservation in reservations:
-            reservations_by_resource[reservation.resource_id].append(reservation)
-
-        available_resources = set()
-
-        hours_qs = ResourceDailyOpeningHours.objects.filter(
-            open_between__overlap=(available_start, available_end, '[)'))
-
-        # check the resources one by one to determine which ones have open slots
-        for resource in queryset.prefetch_related(None).prefetch_related(
-                Prefetch('opening_hours', queryset=hours_qs, to_attr='prefetched_opening_hours')):
-            reservations = reservations_by_resource[resource.id]
-
-            if self._is_resource_available(resource, available_start, available_end, reservations, period):
-                available_resources.add(resource.id)
-
-        return queryset.filter(id__in=available_resources)
-
-    @staticmethod
-    def _is_resource_available(resource, available_start, available_end, reservations, period):
-        opening_hours = resource.get_opening_hours(available_start, available_end, resource.prefetched_opening_hours)
-        hours = next(iter(opening_hours.values()))[0]  # assume there is only one hours obj per day
-
-        if not (hours['opens'] or hours['closes']):
-            return False
-
-        current = max(available_start, hours['opens']) if hours['opens'] is not None else available_start
-        end = min(available_end, hours['closes']) if hours['closes'] is not None else available_end
-
-        if current >= end:
-            # the resource is already closed
-            return False
-
-        if not reservations:
-            # the resource has no reservations, just check if the period fits in the resource's opening times
-            if end - current >= period:
-                return True
-            return False
-
-        # try to find an open slot between reservations and opening / closing times.
-        # start from period start time or opening time depending on which one is earlier.
-        for reservation in reservations:
-            if reservation.end <= current:
-                # this reservation is in the past
-                continue
-            if reservation.begin - current >= period:
-                # found an open slot before the reservation currently being examined
-                return True
-            if reservation.end > end:
-                # the reservation currently being examined ends after the period or closing time,
-                # so no free slots
-                return False
-            # did not find an open slot before the reservation currently being examined,
-            # proceed to next reservation
-            current = reservation.end
-        else:
-            # all reservations checked and no free slot found, check if there is a free slot after the last
-            # reservation
-            if end - reservation.end >= period:
-                return True
+        overlapping_reservations = Reservation.objects.filter(
+            resource__in=queryset, end__gt=available_start, begin__lt=available_end
+        ).current()
+        queryset = queryset.exclude(reservations__in=overlapping_reservations)
+        # and the ones that aren't open for the whole range
+        open_resources = ResourceDailyOpeningHours.objects.filter(
+            open_between__contains=available_start,
+            open_between__endswith__gte=available_end,
+        ).values('resource_id')
+        return queryset.filter(id__in=open_resources)
 
-        return False
+    def _filter_available_between_with_period(self, queryset, available_start, available_end, period):
+        return queryset.free_for_period(available_start, available_end, period)
 
     class Meta:
         model = Resource
@@ -581,9 +570,51 @@ class ResourceFilterBackend(filters.BaseFilterBackend):
         return ResourceFilterSet(request.query_params, queryset=queryset, user=request.user).qs
 
 
+class PrefixSearchQuery(SearchQueryCombinable, Func):
+    """
+    Full text search query matching words that start with the given words
+
+    SearchQuery uses plainto_tsquery(), which can't match prefixes, so the
+    words are marked as prefixes and given to to_tsquery() instead.
+    """
+    function = 'to_tsquery'
+
+    def __init__(self, value, config):
+        words = re.findall(r'[^\W_]+', value)
+        # Combining the queries with | requires the config
+        self.config = config
+        super().__init__(
+            Value(config), Value(' & '.join('%s:*' % word for word in words)), output_field=SearchQueryField()
+        )
+
+
+class ResourceSearchFilterBackend(filters.BaseFilterBackend):
+    """
+    Full text search of resources, most relevant first.
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+        if not re.search(r'[^\W_]', text):
+            return queryset
+
+        query = None
+        for config in SEARCH_CONFIGS.values():
+            config_query = PrefixSearchQuery(text, config)
+            query = config_query if query is None else query | config_query
+        queryset = queryset.filter(search_document=query)
+        queryset = queryset.annotate(search_rank=SearchRank(F('search_document'), query))
+        return queryset.order_by('-search_rank', *Resource._meta.ordering)
+
+
 class LocationFilterBackend(filters.BaseFilterBackend):
     """
     Filters based on resource (or resource unit) location.
+
+    The effective location of the resources is a geography with a GiST
+    index, so the ordering is a KNN scan of the index and the radius filter
+    a single indexed ST_DWithin.
     """
 
     def filter_queryset(self, request, queryset, view):
@@ -597,9 +628,14 @@ class LocationFilterBackend(filters.BaseFilterBackend):
         except ValueError:
             raise exceptions.ParseError("'lat' and 'lon' need to be floating point numbers")
         point = Point(lon, lat, srid=4326)
-        queryset = queryset.annotate(distance=Distance('location', point))
-        queryset = queryset.annotate(unit_distance=Distance('unit__location', point))
-        queryset = queryset.order_by('distance', 'unit_distance')
+        # Reported as the distance on a sphere as before the geography column
+        location = Cast('effective_location', PointField(srid=4326))
+        queryset = queryset.annotate(distance=Distance(location, point))
+        knn_distance = RawSQL('"%s"."effective_location" <-> ST_GeogFromText(%%s)' % Resource._meta.db_table,
+                              (point.ewkt,))
+        # Ordered by the distance alone, as any further sort key would make
+        # PostgreSQL sort all the matches instead of scanning the index
+        queryset = queryset.order_by(knn_distance.asc())
 
         if 'distance' in query_params:
             try:
@@ -608,36 +644,52 @@ class LocationFilterBackend(filters.BaseFilterBackend):
                     raise ValueError()
             except ValueError:
                 raise exceptions.ParseError("'distance' needs to be a floating point number")
-            q = Q(location__distance_lte=(point, distance)) | Q(unit__location__distance_lte=(point, distance))
-            queryset = queryset.filter(q)
+            queryset = queryset.filter(effective_location__dwithin=(point, D(m=distance)))
         return queryset
 
 
+def annotate_is_favorite(queryset, user):
+    """
+    Annotate the resources with whether the user has favorited them, as user_is_favorite
+    """
+    if not user.is_authenticated:
+        return queryset.annotate(user_is_favorite=Value(False, output_field=BooleanField()))
+    favorites = get_user_model().favorite_resources.through.objects.filter(resource=OuterRef('pk'), user=user)
+    return queryset.annotate(user_is_favorite=Exists(favorites))
+
+
+# Resource fields that need the permissions of the user
+PERMISSION_DEPENDENT_FIELDS = ('user_permissions', 'reservable_before', 'reservable_after', 'reservations')
+
+
 class ResourceCacheMixin:
     def _preload_opening_hours(self, times):
-        # We have to evaluate the query here to make sure all the
-        # resources are on the same timezone. In case of different
-        # time zones, we skip this optimization.
-        time_zone = None
+        # The time range depends on the time zone of the resource, so the
+        # resources are grouped by time zone and the opening hours of all
+        # the groups are fetched in one query.
+        resources_by_time_zone = collections.defaultdict(list)
         hours_by_resource = {}
         for resource in self._page:
-            if time_zone:
-                if resource.unit.time_zone != time_zone:
-                    return None
-            else:
-                time_zone = resource.unit.time_zone
+            if not resource.unit:
+                continue
+            resources_by_time_zone[resource.unit.time_zone].append(resource)
             hours_by_resource[resource.id] = []
-        if not time_zone:
-            return None
-
-        begin, end = determine_hours_time_range(times.get('start'), times.get('end'), pytz.timezone(time_zone))
-        hours = ResourceDailyOpeningHours.objects.filter(
-            resource__in=self._page, open_between__overlap=(begin, end, '[)')
-        )
-        for obj in hours:
+        if not hours_by_resource:
+            return hours_by_resource
+
+        condition = Q()
+        for time_zone, resources in resources_by_time_zone.items():
+            begin, end = determine_hours_time_range(times.get('start'), times.get('end'), get_tz(time_zone))
+            condition |= Q(resource__in=resources, open_between__overlap=(begin, end, '[)'))
+        for obj in ResourceDailyOpeningHours.objects.filter(condition):
             hours_by_resource[obj.resource_id].append(obj)
         return hours_by_resource
 
+    def _preload_available_hours(self, times):
+        options = parse_query_availability_options(self.request.query_params)
+        return get_available_hours_for_resources(self._page, times['start'], times['end'],
+                                                 **get_available_hours_kwargs(options))
+
     def _preload_reservations(self, times):
         qs = get_resource_reservations_queryset(times['start'], times['end'])
         reservations = qs.filter(resource__in=self._page)
@@ -664,23 +716,30 @@ class ResourceCacheMixin:
 
     def _get_cache_context(self):
         context = {}
+        # Nothing is preloaded for the fields left out with the fields and omit parameters
+        params = self.request.query_params
 
-        equipment_list = Equipment.objects.filter(resource_equipment__resource__in=self._page).distinct().\
-            select_related('category').prefetch_related('aliases')
-        equipment_cache = {x.id: x for x in equipment_list}
+        if is_field_requested(params, 'equipment'):
+            equipment_list = Equipment.objects.filter(resource_equipment__resource__in=self._page).distinct().\
+                select_related('category').prefetch_related('aliases')
+            equipment_cache = {x.id: x for x in equipment_list}
 
-        context['equipment_cache'] = equipment_cache
-        set_list = ReservationMetadataSet.objects.all().prefetch_related('supported_fields', 'required_fields')
-        context['reservation_metadata_set_cache'] = {x.id: x for x in set_list}
+            context['equipment_cache'] = equipment_cache
+        context['reservation_metadata_set_cache'] = get_reservation_metadata_sets()
 
-        times = parse_query_time_range(self.request.query_params)
+        times = parse_query_time_range(params)
         if times:
-            context['reservations_cache'] = self._preload_reservations(times)
-        context['opening_hours_cache'] = self._preload_opening_hours(times)
+            if is_field_requested(params, 'reservations'):
+                context['reservations_cache'] = self._preload_reservations(times)
+            if is_field_requested(params, 'available_hours'):
+                context['available_hours_cache'] = self._preload_available_hours(times)
+        if is_field_requested(params, 'opening_hours'):
+            context['opening_hours_cache'] = self._preload_opening_hours(times)
 
-        context['accessibility_viewpoint_cache'] = AccessibilityViewpoint.objects.all()
+        context['accessibility_viewpoint_cache'] = get_accessibility_viewpoints()
 
-        self._preload_permissions()
+        if any(is_field_requested(params, field_name) for field_name in PERMISSION_DEPENDENT_FIELDS):
+            self._preload_permissions()
 
         return context
 
@@ -688,12 +747,9 @@ class ResourceCacheMixin:
 class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
                           viewsets.GenericViewSet, ResourceCacheMixin):
     queryset = Resource.objects.select_related('generic_terms', 'unit', 'type', 'reservation_metadata_set')
-    queryset = queryset.prefetch_related('favorited_by', 'resource_equipment', 'resource_equipment__equipment',
+    queryset = queryset.prefetch_related('resource_equipment', 'resource_equipment__equipment',
                                          'purposes', 'images', 'purposes', 'groups')
-    filter_backends = (filters.SearchFilter, ResourceFilterBackend, LocationFilterBackend)
-    search_fields = ('name_fi', 'description_fi', 'unit__name_fi',
-                     'name_sv', 'description_sv', 'unit__name_sv',
-                     'name_en', 'description_en', 'unit__name_en')
+    filter_backends = (ResourceSearchFilterBackend, ResourceFilterBackend, LocationFilterBackend)
     serializer_class = ResourceSerializer
     authentication_classes = (
         list(drf_settings.DEFAULT_AUTHENTICATION_CLASSES) +
@@ -709,11 +765,44 @@ class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
         return context
 
     def get_queryset(self):
-        return self.queryset.visible_for(self.request.user)
+        return annotate_is_favorite(self.queryset.visible_for(self.request.user), self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        cache_key = get_resource_list_cache_key(request)
+        if cache_key is not None:
+            data = get_cached_resource_list(cache_key)
+            if data is not None:
+                return response.Response(data)
+
+        resp = super().list(request, *args, **kwargs)
+        if cache_key is not None and resp.status_code == status.HTTP_200_OK:
+            set_cached_resource_list(cache_key, resp.data)
+        return resp
+
+    @action(detail=False, url_path='available_slots')
+    def available_slots(self, request):
+        """
+        List the earliest free slots of the given duration across the resources matching the filters
+        """
+        options = parse_query_available_slots_options(request.query_params)
+        resources = self.filter_queryset(self.get_queryset()).filter(reservable=True)
+        resources = resources.prefetch_related(None).select_related('unit')
+        slots = get_earliest_free_slots(
+            resources,
+            options['start'],
+            options['start'] + datetime.timedelta(days=options['horizon']),
+            datetime.timedelta(minutes=options['duration']),
+            options['limit'],
+            during_closing=options.get('during_closing', False),
+        )
+        return response.Response([
+            {'resource': resource.id, 'unit': resource.unit_id, 'starts': starts, 'ends': ends}
+            for starts, ends, resource in slots
+        ])
 
 
 class ResourceViewSet(munigeo_api.GeoModelAPIView, mixins.RetrieveModelMixin,
-                      viewsets.GenericViewSet, ResourceCacheMixin):
+                      viewsets.GenericViewSet, ResourceCacheMixin, ConditionalGetMixin):
     serializer_class = ResourceDetailsSerializer
     queryset = ResourceListViewSet.queryset
 
@@ -727,7 +816,14 @@ class ResourceViewSet(munigeo_api.GeoModelAPIView, mixins.RetrieveModelMixin,
         return context
 
     def get_queryset(self):
-        return self.queryset.visible_for(self.request.user)
+        return annotate_is_favorite(self.queryset.visible_for(self.request.user), self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.respond_conditionally(
+            request, instance.modified_at, get_data_fingerprint(),
+            lambda: response.Response(self.get_serializer(instance).data)
+        )
 
     def _set_favorite(self, request, value):
         resource = self.get_object()
@@ -1,11 +1,16 @@
+from django.contrib.postgres.search import TrigramSimilarity
 from django.db.models import Q
+from django.db.models.functions import Greatest
 from django.utils.encoding import force_text
+from modeltranslation.utils import build_localized_fieldname, get_language
 from rest_framework import viewsets
 from rest_framework.fields import BooleanField
 from rest_framework.response import Response
 
 from resources.api.resource import ResourceListViewSet
 from resources.api.unit import UnitViewSet
+from resources.auth import is_authenticated_user, is_general_admin
+from resources.response_cache import get_cached_typeahead, get_typeahead_cache_key, set_cached_typeahead
 
 
 class TypeaheadViewSet(viewsets.ViewSet):
@@ -51,26 +56,62 @@ class TypeaheadViewSet(viewsets.ViewSet):
             if obj_list:
                 yield obj_list
 
+    def get_visibility_class(self, request, full):
+        """
+        Get the class of users who see the same suggestions as the user of the request
+
+        Full suggestions show user specific data, such as favorites, so
+        they are only shared by anonymous users.
+        """
+        user = request.user
+        if not is_authenticated_user(user):
+            return 'anonymous'
+        if is_general_admin(user) and not full:
+            return 'general-admin'
+        return 'user-%s' % user.pk
+
     def get_single_object_type_object_list(self, request, obj_name, query_parts, full=False):
-        # TODO: Could add caching here, keyed on `query_parts`
         obj_schema = self.objects.get(obj_name)
         if not obj_schema:
             return None
-        q = self.build_q(obj_schema["search_fields"], query_parts)
 
+        cache_key = get_typeahead_cache_key(
+            obj_name, query_parts, full, self.get_visibility_class(request, full)
+        )
+        if cache_key is not None:
+            data = get_cached_typeahead(cache_key)
+            if data is not None:
+                return (obj_name, data) if data else None
+
+        data = self.get_object_data(request, obj_schema, query_parts, full)
+        if cache_key is not None:
+            set_cached_typeahead(cache_key, data)
+        return (obj_name, data) if data else None
+
+    def get_object_data(self, request, obj_schema, query_parts, full):
         # Defer serialization and queryset retrieval to the viewsets that are in use
         # in the general API.
         viewset_class = obj_schema["viewset"]
         object_viewset = viewset_class(request=request)
         object_viewset.initial(request)
-        queryset = object_viewset.get_queryset().filter(q)[:10]  # TODO: Sort these?
-        if queryset.exists():
-            if full:
-                data = object_viewset.get_serializer(queryset, many=True).data
-            else:
-                text_getter = obj_schema["text_getter"]
-                data = [{"id": obj.pk, "text": text_getter(obj)} for obj in queryset]
-            return (obj_name, data)
+
+        # The names are matched in the current language, where the trigram
+        # indexes serve both the matching and the ranking by similarity
+        language = get_language()
+        fields = [build_localized_fieldname(field, language) for field in obj_schema["search_fields"]]
+        queryset = object_viewset.get_queryset().filter(self.build_q(fields, query_parts))
+        similarity = None
+        for field in fields:
+            field_similarity = TrigramSimilarity(field, ' '.join(query_parts))
+            similarity = field_similarity if similarity is None else Greatest(similarity, field_similarity)
+        queryset = queryset.annotate(typeahead_similarity=similarity).order_by('-typeahead_similarity', 'pk')
+
+        if full:
+            objects = list(queryset[:10])
+            # a plain list for the cache, as the serializer data refers to the serializer
+            return list(object_viewset.get_serializer(objects, many=True).data) if objects else []
+        text_getter = obj_schema["text_getter"]
+        return [{"id": obj.pk, "text": text_getter(obj)} for obj in queryset.prefetch_related(None)[:10]]
 
     def build_q(self, fields, query_parts):
         q = Q()
@@ -7,6 +7,7 @@ import time
 import functools
 
 from django.conf import settings
+from django.db.models import Max, Min
 from modeltranslation.translator import translator
 
 from resources.models import Resource, Unit, UnitIdentifier
@@ -18,6 +19,22 @@ def get_muni(muni_id):
     return Municipality.objects.get(id=muni_id)
 
 
+def get_periods_date_range(unit):
+    dates = unit.periods.aggregate(begin=Min('start'), end=Max('end'))
+    return dates['begin'], dates['end']
+
+
+def update_unit_opening_hours(unit, old_periods_date_range):
+    """
+    Update the opening hours of the unit's resources after its periods were re-imported
+
+    Only the dates covered by either the old or the new periods are recomputed.
+    """
+    dates = [date for date in old_periods_date_range + get_periods_date_range(unit) if date]
+    if dates:
+        unit.update_opening_hours(min(dates), max(dates))
+
+
 class Importer(object):
 
     @staticmethod
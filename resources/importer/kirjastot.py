@@ -6,7 +6,7 @@ from django.db import transaction
 from sentry_sdk import capture_message
 from resources.models import Unit
 from typing import Dict, List
-from .base import Importer, register_importer
+from .base import Importer, get_periods_date_range, register_importer, update_unit_opening_hours
 
 CLOSED_HOURS = 0
 STAFFED_HOURS = 1
@@ -47,9 +47,10 @@ def process_varaamo_libraries():
         if data:
             try:
                 with transaction.atomic():
+                    old_periods_date_range = get_periods_date_range(varaamo_unit)
                     varaamo_unit.periods.all().delete()
                     process_periods(data, varaamo_unit)
-                    varaamo_unit.update_opening_hours()
+                    update_unit_opening_hours(varaamo_unit, old_periods_date_range)
             except Exception as e:
                 import traceback
                 print("Problem in processing data of library ", varaamo_unit, traceback.format_exc())
@@ -151,7 +152,6 @@ def process_periods(library, unit):
                            closed=day_closed)
 
     print("Periods processed for", unit)
-    unit.update_opening_hours()
 
 
 def parse_schedule(day_schedule: Dict[str, any]) -> Dict[str, any]:
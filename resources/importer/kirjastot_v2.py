@@ -10,7 +10,7 @@ from django.db import transaction
 from django.db.models import Q
 
 from resources.models import Unit, UnitIdentifier
-from .base import Importer, register_importer
+from .base import Importer, get_periods_date_range, register_importer, update_unit_opening_hours
 
 from sentry_sdk import capture_message
 
@@ -62,9 +62,10 @@ def process_varaamo_libraries():
         if data:
             try:
                 with transaction.atomic():
+                    old_periods_date_range = get_periods_date_range(varaamo_unit)
                     varaamo_unit.periods.all().delete()
                     process_periods(data, varaamo_unit)
-                    varaamo_unit.update_opening_hours()
+                    update_unit_opening_hours(varaamo_unit, old_periods_date_range)
             except Exception as e:
                 print("Problem in processing data of library ", varaamo_unit, e)
                 problems.append(" ".join(["Problem in processing data of library ", str(varaamo_unit), str(e)]))
@@ -101,10 +102,11 @@ def get_helmet_timetables():
 
         unit = identifier.unit
         with transaction.atomic():
+            old_periods_date_range = get_periods_date_range(unit)
             unit.periods.all().delete()
             print("Processing periods for %s" % unit)
             process_v2_periods(unit, unit_data)
-            unit.update_opening_hours()
+            update_unit_opening_hours(unit, old_periods_date_range)
 
 
 def process_v2_periods(unit, unit_data):
@@ -269,7 +271,6 @@ def process_periods(data, unit):
         nper.save()
 
     print("Periods processed for ", unit)
-    unit.update_opening_hours()
 
 
 def get_time_range(start=None, back=1, forward=12):
@@ -0,0 +1,55 @@
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations
+
+OVERLAPPING_RESERVATIONS_SQL = """
+SELECT a.resource_id, a.id, b.id
+FROM resources_reservation a
+JOIN resources_reservation b ON b.resource_id = a.resource_id AND b.id > a.id AND b.duration && a.duration
+WHERE a.state NOT IN ('cancelled', 'denied') AND b.state NOT IN ('cancelled', 'denied')
+ORDER BY a.resource_id, a.id, b.id
+"""
+
+
+def check_no_overlapping_reservations(apps, schema_editor):
+    # Reservations used to be checked against each other only when they were
+    # made, and the Exchange sync did not check them at all, so there may be
+    # overlapping ones. They have to be cancelled or moved by hand first, as
+    # the migration must not change bookings behind the users' backs.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(OVERLAPPING_RESERVATIONS_SQL)
+        overlaps = cursor.fetchall()
+    if overlaps:
+        raise RuntimeError(
+            'Overlapping reservations must be cancelled, denied or moved before migrating:\n%s' % '\n'.join(
+                'resource %s: reservations %s and %s' % overlap for overlap in overlaps
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0079_reservation_extra_questions'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        # The constraint is on the duration, which is only kept up to date by Reservation.save()
+        migrations.RunSQL(
+            """
+            UPDATE resources_reservation SET duration = tstzrange(begin, "end", '[)')
+            WHERE duration IS DISTINCT FROM tstzrange(begin, "end", '[)')
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(check_no_overlapping_reservations, migrations.RunPython.noop),
+        migrations.RunSQL(
+            """
+            SET CONSTRAINTS ALL IMMEDIATE;
+            ALTER TABLE resources_reservation ADD CONSTRAINT resources_reservation_no_overlap
+            EXCLUDE USING gist (resource_id WITH =, duration WITH &&)
+            WHERE (state NOT IN ('cancelled', 'denied'))
+            """,
+            "ALTER TABLE resources_reservation DROP CONSTRAINT resources_reservation_no_overlap",
+        ),
+    ]
@@ -0,0 +1,40 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0081_reservation_begin_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='resources_resource_search'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE resources_resource AS resource SET search_document =
+                setweight(to_tsvector('finnish', COALESCE(resource.name_fi, '')), 'A') ||
+                setweight(to_tsvector('swedish', COALESCE(resource.name_sv, '')), 'A') ||
+                setweight(to_tsvector('english', COALESCE(resource.name_en, '')), 'A') ||
+                setweight(to_tsvector('finnish', COALESCE(unit.name_fi, '')), 'B') ||
+                setweight(to_tsvector('swedish', COALESCE(unit.name_sv, '')), 'B') ||
+                setweight(to_tsvector('english', COALESCE(unit.name_en, '')), 'B') ||
+                setweight(to_tsvector('finnish', COALESCE(resource.description_fi, '')), 'C') ||
+                setweight(to_tsvector('swedish', COALESCE(resource.description_sv, '')), 'C') ||
+                setweight(to_tsvector('english', COALESCE(resource.description_en, '')), 'C')
+            FROM resources_resource AS resource_with_unit
+            LEFT JOIN resources_unit AS unit ON unit.id = resource_with_unit.unit_id
+            WHERE resource_with_unit.id = resource.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Typeahead matches names with UPPER(name) LIKE UPPER(...), which these indexes serve
+INDEXED_COLUMNS = [
+    (table, column)
+    for table in ('resources_resource', 'resources_unit')
+    for column in ('name_fi', 'name_sv', 'name_en')
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0082_resource_search_document'),
+    ]
+
+    operations = [TrigramExtension()] + [
+        migrations.RunSQL(
+            'CREATE INDEX {table}_{column}_trgm ON {table} USING gin (UPPER({column}) gin_trgm_ops)'.format(
+                table=table, column=column,
+            ),
+            'DROP INDEX {table}_{column}_trgm'.format(table=table, column=column),
+        )
+        for table, column in INDEXED_COLUMNS
+    ]
@@ -0,0 +1,28 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0083_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='effective_location',
+            field=django.contrib.gis.db.models.fields.PointField(
+                editable=False, geography=True, null=True, srid=4326
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE resources_resource AS resource SET effective_location = COALESCE(
+                resource.location,
+                (SELECT unit.location FROM resources_unit AS unit WHERE unit.id = resource.unit_id)
+            )::geography
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,14 +1,18 @@
+import bisect
 import datetime
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
-import pytz
 import django.contrib.postgres.fields as pgfields
+from django.conf import settings
 from django.contrib.gis.db import models
 from django.core.exceptions import ValidationError
 from django.utils.dateformat import time_format
 from django.utils.translation import ugettext_lazy as _
 from psycopg2.extras import DateRange, NumericRange
 
+from .lookup_cache import PERIOD_SCHEDULES, get_row_values, set_row_value
+from .utils import get_local_datetime, get_tz
+
 
 STATE_BOOLS = {
     False: _('open'),
@@ -18,7 +22,7 @@ STATE_BOOLS = {
 
 
 def combine_datetime(date, time, tz):
-    return tz.localize(datetime.datetime.combine(date, time))
+    return get_local_datetime(tz, date, time)
 
 
 def datetime_to_date(dt, tz):
@@ -29,6 +33,131 @@ def datetime_to_date(dt, tz):
     return dt.date()
 
 
+def merge_intervals(intervals):
+    """
+    Returns the given (begin, end) intervals sorted, with overlapping
+    and adjacent intervals merged together
+
+    :type intervals: list[tuple[datetime.datetime, datetime.datetime]]
+    :rtype: list[tuple[datetime.datetime, datetime.datetime]]
+    """
+    merged = []
+    for begin, end in sorted(intervals):
+        if merged and begin <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def subtract_intervals(intervals, busy, min_length=None):
+    """
+    Returns the parts of the given intervals that are not covered by
+    any of the busy intervals
+
+    Both interval lists are sorted and merged first, after which the busy
+    intervals overlapping each interval are located with a binary search
+    and swept through once. Resulting intervals shorter than min_length
+    are left out.
+
+    :type intervals: list[tuple[datetime.datetime, datetime.datetime]]
+    :type busy: list[tuple[datetime.datetime, datetime.datetime]]
+    :type min_length: datetime.timedelta | None
+    :rtype: list[tuple[datetime.datetime, datetime.datetime]]
+    """
+    busy = merge_intervals(busy)
+    busy_ends = [end for begin, end in busy]
+
+    free = []
+    for begin, end in merge_intervals(intervals):
+        current = begin
+        i = bisect.bisect_right(busy_ends, begin)
+        while i < len(busy) and busy[i][0] < end:
+            if busy[i][0] > current:
+                free.append((current, busy[i][0]))
+            current = max(current, busy[i][1])
+            i += 1
+        if current < end:
+            free.append((current, end))
+
+    if min_length:
+        free = [(begin, end) for begin, end in free if end - begin >= min_length]
+    return free
+
+
+WeeklySchedule = namedtuple('WeeklySchedule', ('start', 'end', 'weekdays'))
+
+
+def compile_period(period, days):
+    """
+    Compile a period and its days into a weekly schedule
+
+    The schedule holds the validity range of the period and a table of
+    (opens, closes) times indexed by weekday. Weekdays when the period is
+    closed are None. The compiled schedule is stored on the period instance.
+
+    :type period: Period
+    :type days: list[Day]
+    :rtype: WeeklySchedule
+    """
+    # Currently the 'closed' field of periods do not always contain
+    # sensible data, so it is ignored and only the days are used.
+    weekdays = [None] * 7
+    for day in days:
+        if day.closed or not day.opens or not day.closes or day.opens == day.closes:
+            continue
+        weekdays[day.weekday] = (day.opens, day.closes)
+
+    schedule = WeeklySchedule(period.start, period.end, tuple(weekdays))
+    period._compiled_schedule = schedule
+    return schedule
+
+
+def is_period_schedule_cache_enabled():
+    return getattr(settings, 'RESPA_PERIOD_SCHEDULE_CACHE_ENABLED', False)
+
+
+def compile_periods(periods, reuse=True):
+    """
+    Compile the weekly schedules of the given periods
+
+    If enabled with the RESPA_PERIOD_SCHEDULE_CACHE_ENABLED setting,
+    compiled schedules are kept in the process wide lookup cache by period
+    id, and reused for as long as no period or day has been changed since
+    and the dates of the period are the same. As with the other shared
+    caches, RESPA_LOOKUP_CACHE should then select a cache shared by all the
+    processes. Pass reuse=False to compile from the days in the database
+    regardless. The days of the periods to compile are fetched with a single
+    query.
+
+    :type periods: list[Period]
+    :type reuse: bool
+    """
+    cached, generation = {}, None
+    if is_period_schedule_cache_enabled():
+        # Fresh compilations are stored for reuse either way
+        period_ids = [p.id for p in periods if p.id] if reuse else []
+        cached, generation = get_row_values(PERIOD_SCHEDULES, period_ids)
+    uncompiled = []
+    for period in periods:
+        schedule = cached.get(period.id)
+        if schedule is not None and (schedule.start, schedule.end) == (period.start, period.end):
+            period._compiled_schedule = schedule
+        else:
+            uncompiled.append(period)
+    if not uncompiled:
+        return
+
+    days_by_period = {p.id: [] for p in uncompiled}
+    for day in Day.objects.filter(period__in=uncompiled):
+        days_by_period[day.period_id].append(day)
+    for period in uncompiled:
+        schedule = compile_period(period, days_by_period[period.id])
+        if period.id and generation is not None:
+            set_row_value(PERIOD_SCHEDULES, period.id, generation, schedule)
+
+
 def get_opening_hours(time_zone, periods, begin, end=None):
     """
     Returns opening and closing times for a given date range
@@ -43,7 +172,7 @@ def get_opening_hours(time_zone, periods, begin, end=None):
     :type end: datetime.date | None
     """
 
-    tz = pytz.timezone(time_zone)
+    tz = get_tz(time_zone)
     if begin is not None:
         if isinstance(begin, datetime.datetime):
             begin = datetime_to_date(begin, tz)
@@ -69,33 +198,29 @@ def get_opening_hours(time_zone, periods, begin, end=None):
             p.priority = 0
     periods.sort(key=lambda x: (-x.priority, x.end - x.start))
 
-    days = list(Day.objects.filter(period__in=periods))
-    for period in periods:
-        period.range_days = {day.weekday: day for day in days if day.period_id == period.id}
+    compile_periods(periods)
 
-    date = begin
-    dates = OrderedDict()
-    while date <= end:
-        opens = None
-        closes = None
-        for period in periods:
-            if period.start > date or period.end < date:
-                continue
-            # Currently the 'closed' field of periods do not
-            # always contain sensible data. Ignore it for now.
-            if False and period.closed:
-                break
-            day = period.range_days.get(date.weekday())
-            if day is None or day.closed:
-                break
-            opens = combine_datetime(date, day.opens, tz)
-            closes = combine_datetime(date, day.closes, tz)
-            if opens == closes:
-                # The interval is zero-length
-                opens = None
-                closes = None
-            break
+    # Find out the weekly schedule in effect for each date by laying the
+    # periods over the range in reverse order of precedence, so that the
+    # one taking precedence is the one left in place for each date.
+    day_count = (end - begin).days + 1
+    schedules = [None] * day_count
+    for period in reversed(periods):
+        schedule = period._compiled_schedule
+        first = max((schedule.start - begin).days, 0)
+        last = min((schedule.end - begin).days, day_count - 1)
+        schedules[first:last + 1] = [schedule.weekdays] * (last - first + 1)
 
+    dates = OrderedDict()
+    date = begin
+    for weekdays in schedules:
+        hours = weekdays[date.weekday()] if weekdays else None
+        if hours:
+            opens = combine_datetime(date, hours[0], tz)
+            closes = combine_datetime(date, hours[1], tz)
+        else:
+            opens = None
+            closes = None
         dates[date] = [{'opens': opens, 'closes': closes}]
         date += datetime.timedelta(days=1)
 
@@ -0,0 +1,163 @@
+"""
+In-process cache of rarely changing lookup tables
+
+Reservation metadata sets and accessibility viewpoints are needed by almost
+every API request but change only a few times a year, so each process keeps
+them in memory. Every table has a generation token in the Django cache that
+is replaced by the model signal handlers whenever the table changes, and the
+in-memory copy is reloaded when its generation no longer matches.
+
+Values derived from single rows, such as the compiled weekly schedules of
+opening hour periods, are kept the same way, keyed by the table and the row.
+
+The cache selected by the RESPA_LOOKUP_CACHE setting should be shared by all
+the processes serving the API for the changes to be seen by all of them.
+Otherwise the in-memory copies are still reloaded at least every
+LOOKUP_CACHE_TIMEOUT seconds.
+"""
+import threading
+import time
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+LOOKUP_CACHE_TIMEOUT = 5 * 60
+
+RESERVATION_METADATA_SETS = 'reservation-metadata-sets'
+ACCESSIBILITY_VIEWPOINTS = 'accessibility-viewpoints'
+PERIOD_SCHEDULES = 'period-schedules'
+
+# table name -> (generation, load time, value)
+_entries = {}
+# (table name, row key) -> (generation, load time, value)
+_row_entries = {}
+_lock = threading.Lock()
+
+
+def _get_cache():
+    return caches[getattr(settings, 'RESPA_LOOKUP_CACHE', 'default')]
+
+
+def _get_generation_key(name):
+    return 'lookup-generation:%s' % name
+
+
+def _get_generation(name):
+    cache = _get_cache()
+    key = _get_generation_key(name)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def _set_new_generation(name):
+    _get_cache().set(_get_generation_key(name), uuid.uuid4().hex, None)
+
+
+def _get_lookup(name, load):
+    generation = _get_generation(name)
+    entry = _entries.get(name)
+    now = time.monotonic()
+    if entry is not None and entry[0] == generation and now - entry[1] < LOOKUP_CACHE_TIMEOUT:
+        return entry[2]
+    value = load()
+    with _lock:
+        _entries[name] = (generation, now, value)
+    return value
+
+
+def invalidate_lookup(name):
+    """
+    Make the cached copies of the given lookup table get reloaded on next use
+
+    As with the other caches, the generation is replaced right away and once
+    more after the current transaction is committed.
+
+    :type name: str
+    """
+    with _lock:
+        _entries.pop(name, None)
+    # Row entries are left to be replaced, as they are many and the
+    # generation already tells they are obsolete.
+    _set_new_generation(name)
+    transaction.on_commit(lambda: _set_new_generation(name))
+
+
+def clear_lookup_cache():
+    """
+    Forget the in-memory copies of all the lookup tables of this process
+    """
+    with _lock:
+        _entries.clear()
+        _row_entries.clear()
+
+
+def get_row_values(name, keys):
+    """
+    Get the current values cached for the given rows of a lookup table
+
+    Returns the values found and the generation to pass to set_row_value()
+    for the values that are loaded now.
+
+    :type name: str
+    :rtype: tuple[dict, str]
+    """
+    generation = _get_generation(name)
+    now = time.monotonic()
+    values = {}
+    for key in keys:
+        entry = _row_entries.get((name, key))
+        if entry is not None and entry[0] == generation and now - entry[1] < LOOKUP_CACHE_TIMEOUT:
+            values[key] = entry[2]
+    return values, generation
+
+
+def set_row_value(name, key, generation, value):
+    """
+    Cache a value derived from a row of a lookup table as of the given generation
+
+    :type name: str
+    :type generation: str
+    """
+    with _lock:
+        _row_entries[(name, key)] = (generation, time.monotonic(), value)
+
+
+def _load_reservation_metadata_sets():
+    model = apps.get_model('resources', 'ReservationMetadataSet')
+    return {
+        metadata_set.id: metadata_set
+        for metadata_set in model.objects.prefetch_related('supported_fields', 'required_fields')
+    }
+
+
+def _load_accessibility_viewpoints():
+    model = apps.get_model('resources', 'AccessibilityViewpoint')
+    return list(model.objects.all())
+
+
+def get_reservation_metadata_sets():
+    """
+    Get all the reservation metadata sets with their fields prefetched
+
+    The returned objects are shared and must not be modified.
+
+    :rtype: dict[int, ReservationMetadataSet]
+    """
+    return _get_lookup(RESERVATION_METADATA_SETS, _load_reservation_metadata_sets)
+
+
+def get_accessibility_viewpoints():
+    """
+    Get all the accessibility viewpoints in their default ordering
+
+    The returned objects are shared and must not be modified.
+
+    :rtype: list[AccessibilityViewpoint]
+    """
+    return _get_lookup(ACCESSIBILITY_VIEWPOINTS, _load_accessibility_viewpoints)
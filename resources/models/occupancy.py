@@ -0,0 +1,224 @@
+"""
+Per-resource daily occupancy bitmaps
+
+A bitmap covers one local day of a resource at the granularity of the
+resource's slot size: bit n stands for the nth slot counted from midnight,
+and it is set when any current reservation overlaps the slot.
+
+The bitmaps are kept in the Django cache, keyed by a generation token of the
+resource that is replaced whenever its reservations change.
+As the bitmaps are shared by all the processes serving the API, they are
+only used when enabled with the RESPA_OCCUPANCY_BITMAPS_ENABLED setting,
+which should be done only with a cache backend shared by the processes
+(the RESPA_OCCUPANCY_CACHE setting selects the cache to use).
+"""
+import datetime
+import uuid
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .utils import get_local_midnight
+
+# Bitmaps are rebuilt at least this often even if the generation of the
+# resource stays the same
+OCCUPANCY_CACHE_TIMEOUT = 60 * 60
+
+DayOccupancy = namedtuple('DayOccupancy', ['reserved'])
+
+
+def is_occupancy_enabled():
+    return getattr(settings, 'RESPA_OCCUPANCY_BITMAPS_ENABLED', False)
+
+
+def _get_cache():
+    return caches[getattr(settings, 'RESPA_OCCUPANCY_CACHE', 'default')]
+
+
+def _get_generation_key(resource_id):
+    return 'occupancy-generation:%s' % resource_id
+
+
+def _get_bitmap_key(resource_id, date, slot_size, generation):
+    return 'occupancy-reserved:%s:%s:%d:%s' % (resource_id, date.isoformat(), slot_size.total_seconds(), generation)
+
+
+def _get_tz(resource):
+    return resource.unit.get_tz() if resource.unit else timezone.get_current_timezone()
+
+
+def _get_day_range(tz, date):
+    return get_local_midnight(tz, date), get_local_midnight(tz, date + datetime.timedelta(days=1))
+
+
+def get_slot_mask(day_begin, day_end, slot_size, begin, end):
+    """
+    Get a bitmap of the slots of a day that the given time range overlaps
+
+    :type day_begin: datetime.datetime
+    :type day_end: datetime.datetime
+    :type slot_size: datetime.timedelta
+    :type begin: datetime.datetime
+    :type end: datetime.datetime
+    :rtype: int
+    """
+    begin = max(begin, day_begin)
+    end = min(end, day_end)
+    if begin >= end:
+        return 0
+    first = (begin - day_begin) // slot_size
+    last = -((day_begin - end) // slot_size)
+    return ((1 << (last - first)) - 1) << first
+
+
+def _get_generations(cache, resource_ids):
+    keys = {_get_generation_key(resource_id): resource_id for resource_id in resource_ids}
+    generations = {keys[key]: generation for key, generation in cache.get_many(list(keys)).items()}
+    for key, resource_id in keys.items():
+        if resource_id not in generations:
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[resource_id] = cache.get(key)
+    return generations
+
+
+def _set_new_generations(resource_ids):
+    cache = _get_cache()
+    cache.set_many({_get_generation_key(resource_id): uuid.uuid4().hex for resource_id in resource_ids}, None)
+
+
+def invalidate_occupancy(resource_ids):
+    """
+    Make the occupancy bitmaps of the given resources get rebuilt on next use
+
+    The bitmaps are invalidated right away and once more after the current
+    transaction is committed, so that bitmaps built from data read before
+    the commit are not used after it.
+
+    The reservation signal handlers call this, so reservations changed with
+    QuerySet.update(), bulk_create() or raw SQL must be followed by a call
+    to this for their resources, or the bitmaps stay stale until they time out.
+
+    :type resource_ids: list[str]
+    """
+    if not is_occupancy_enabled():
+        return
+    resource_ids = list(resource_ids)
+    _set_new_generations(resource_ids)
+    transaction.on_commit(lambda: _set_new_generations(resource_ids))
+
+
+def build_occupancy(resources, dates):
+    """
+    Build the occupancy bitmaps of the given resources for the given dates
+
+    Reservations of all the resources are fetched with one query.
+
+    :type resources: list[Resource]
+    :type dates: list[datetime.date]
+    :rtype: dict[tuple[str, datetime.date], DayOccupancy]
+    """
+    resource_model = apps.get_model('resources', 'Resource')
+    reservation_model = apps.get_model('resources', 'Reservation')
+
+    day_ranges = {}
+    for resource in resources:
+        tz = _get_tz(resource)
+        for date in dates:
+            day_ranges[(resource.id, date)] = _get_day_range(tz, date)
+    if not day_ranges:
+        return {}
+    range_begin = min(day_begin for day_begin, day_end in day_ranges.values())
+    range_end = max(day_end for day_begin, day_end in day_ranges.values())
+
+    reserved_intervals = {}
+    reservations = reservation_model.objects.filter(
+        resource__in=resources, end__gt=range_begin, begin__lt=range_end
+    ).current().values_list('resource_id', 'begin', 'end')
+    for resource_id, begin, end in reservations:
+        reserved_intervals.setdefault(resource_id, []).append((begin, end))
+
+    slot_sizes = {resource.id: resource.slot_size or resource_model._meta.get_field('slot_size').default
+                  for resource in resources}
+    occupancy = {}
+    for (resource_id, date), (day_begin, day_end) in day_ranges.items():
+        slot_size = slot_sizes[resource_id]
+        reserved_bits = 0
+        for begin, end in reserved_intervals.get(resource_id, []):
+            reserved_bits |= get_slot_mask(day_begin, day_end, slot_size, begin, end)
+        occupancy[(resource_id, date)] = DayOccupancy(reserved_bits)
+    return occupancy
+
+
+def get_occupancy(resources, dates):
+    """
+    Get the occupancy bitmaps of the given resources for the given dates
+
+    Bitmaps are taken from the cache when possible, and the missing ones
+    are built in one go and stored in the cache.
+
+    :type resources: list[Resource]
+    :type dates: list[datetime.date]
+    :rtype: dict[tuple[str, datetime.date], DayOccupancy]
+    """
+    resources = list(resources)
+    cache = _get_cache()
+    generations = _get_generations(cache, [resource.id for resource in resources])
+
+    keys = {}
+    for resource in resources:
+        for date in dates:
+            key = _get_bitmap_key(resource.id, date, resource.slot_size, generations[resource.id])
+            keys[key] = (resource.id, date)
+    cached = cache.get_many(list(keys))
+    occupancy = {keys[key]: DayOccupancy(*value) for key, value in cached.items()}
+
+    missing = {resource_date for resource_date in keys.values() if resource_date not in occupancy}
+    if missing:
+        missing_resources = [resource for resource in resources if any(
+            (resource.id, date) in missing for date in dates
+        )]
+        missing_dates = sorted({date for resource_id, date in missing})
+        built = build_occupancy(missing_resources, missing_dates)
+        occupancy.update(built)
+        cache.set_many({
+            key: tuple(built[resource_date])
+            for key, resource_date in keys.items() if resource_date in built and resource_date in missing
+        }, OCCUPANCY_CACHE_TIMEOUT)
+    return occupancy
+
+
+def is_reserved_by_occupancy(resource, begin, end):
+    """
+    Check from the occupancy bitmaps whether any reservation overlaps the given time range
+
+    Returns False only if no slot overlapped by the range is reserved, and
+    None if the bitmaps can't tell for sure. A reserved slot does not mean
+    that the range itself is reserved, as reservations needn't be aligned
+    with slots.
+
+    :type resource: Resource
+    :type begin: datetime.datetime
+    :type end: datetime.datetime
+    :rtype: bool | None
+    """
+    if not is_occupancy_enabled() or not resource.slot_size:
+        return None
+
+    tz = _get_tz(resource)
+    dates = []
+    date = begin.astimezone(tz).date()
+    while date <= end.astimezone(tz).date():
+        dates.append(date)
+        date += datetime.timedelta(days=1)
+
+    occupancy = get_occupancy([resource], dates)
+    for date in dates:
+        day_begin, day_end = _get_day_range(tz, date)
+        mask = get_slot_mask(day_begin, day_end, resource.slot_size, begin, end)
+        if occupancy[(resource.id, date)].reserved & mask:
+            return None
+    return False
@@ -79,6 +79,21 @@ class ReservationQuerySet(models.QuerySet):
         return self.filter(Q(user=user) | Q(resource__in=allowed_resources))
 
 
+# Exclusion constraint that keeps current reservations of a resource from overlapping
+RESERVATION_OVERLAP_CONSTRAINT = 'resources_reservation_no_overlap'
+
+
+def is_reservation_overlap_error(exc):
+    """
+    Check whether an IntegrityError was raised by the reservation overlap constraint
+
+    :type exc: django.db.IntegrityError
+    :rtype: bool
+    """
+    diag = getattr(exc.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == RESERVATION_OVERLAP_CONSTRAINT
+
+
 class Reservation(ModifiableModel):
     CREATED = 'created'
     CANCELLED = 'cancelled'
@@ -143,6 +158,10 @@ class Reservation(ModifiableModel):
         verbose_name = _("reservation")
         verbose_name_plural = _("reservations")
         ordering = ('id',)
+        indexes = [
+            # used by keyset pagination of the reservation listing
+            models.Index(fields=['begin', 'id'], name='resources_reservation_begin'),
+        ]
 
     def _save_dt(self, attr, dt):
         """
@@ -287,7 +306,7 @@ class Reservation(ModifiableModel):
         return self.resource.can_view_catering_orders(user)
 
     def format_time(self):
-        tz = self.resource.unit.get_tz()
+        tz = self.resource.get_tz()
         begin = self.begin.astimezone(tz)
         end = self.end.astimezone(tz)
         return format_dt_range(translation.get_language(), begin, end)
@@ -311,8 +330,11 @@ class Reservation(ModifiableModel):
             raise ValidationError(_("You must end the reservation after it has begun"))
 
         # Check that begin and end times are on valid time slots.
-        opening_hours = self.resource.get_opening_hours(self.begin.date(), self.end.date())
-        for dt in (self.begin, self.end):
+        tz = self.resource.get_tz()
+        begin = self.begin.astimezone(tz)
+        end = self.end.astimezone(tz)
+        opening_hours = self.resource.get_opening_hours(begin.date(), end.date())
+        for dt in (begin, end):
             days = opening_hours.get(dt.date(), [])
             day = next((day for day in days if day['opens'] is not None and day['opens'] <= dt <= day['closes']), None)
             if day and not is_valid_time_slot(dt, self.resource.slot_size, day['opens']):
@@ -462,6 +484,10 @@ class Reservation(ModifiableModel):
 
     def save(self, *args, **kwargs):
         self.duration = DateTimeTZRange(self.begin, self.end, '[)')
+        # Conditional GETs of reservations rely on the modification time being up to date
+        self.modified_at = timezone.now()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'modified_at'}
 
         if not self.access_code:
             access_code_type = self.resource.access_code_type
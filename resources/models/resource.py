@@ -1,19 +1,21 @@
 import datetime
+import heapq
 import os
 import re
-import pytz
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from decimal import Decimal
 
 import arrow
 import django.db.models as dbm
 from django.db.models import Q
+from django.db.models.expressions import RawSQL
 from django.apps import apps
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.validators import MinValueValidator
+from django.db import connection
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
@@ -22,6 +24,8 @@ from django.utils.six import BytesIO
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import pgettext_lazy
 from django.contrib.postgres.fields import HStoreField, DateTimeRangeField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from .gistindex import GistIndex
 from psycopg2.extras import DateTimeTZRange
 from image_cropping import ImageRatioField
@@ -32,12 +36,17 @@ from guardian.core import ObjectPermissionChecker
 from ..auth import is_authenticated_user, is_general_admin
 from ..errors import InvalidImage
 from ..fields import EquipmentField
+from ..response_cache import invalidate_resource_list_cache
 from .accessibility import AccessibilityValue, AccessibilityViewpoint, ResourceAccessibility
 from .base import AutoIdentifiedModel, NameIdentifiedModel, ModifiableModel
-from .utils import create_datetime_days_from_now, get_translated, get_translated_name, humanize_duration
+from .utils import (
+    create_datetime_days_from_now, get_local_midnight, get_translated, get_translated_name, humanize_duration
+)
 from .equipment import Equipment
 from .unit import Unit
-from .availability import get_opening_hours
+from .availability import combine_datetime, compile_periods, get_opening_hours, subtract_intervals
+from .lookup_cache import get_reservation_metadata_sets
+from .occupancy import is_reserved_by_occupancy
 from .permissions import RESOURCE_GROUP_PERMISSIONS
 
 
@@ -73,14 +82,352 @@ def determine_hours_time_range(begin, end, tz):
     if end is None:
         end = begin
 
-    midnight = datetime.time(0, 0)
-    begin = tz.localize(datetime.datetime.combine(begin, midnight))
-    end = tz.localize(datetime.datetime.combine(end, midnight))
-    end += datetime.timedelta(days=1)
+    begin = get_local_midnight(tz, begin)
+    end = get_local_midnight(tz, end + datetime.timedelta(days=1))
 
     return begin, end
 
 
+def get_available_hours_for_resources(resources, start, end, duration=None, reservation=None,
+                                      during_closing=False):
+    """
+    Returns hours that the given resources are not reserved for, keyed by resource id
+
+    Opening hours and current reservations of all the resources are fetched
+    with one query each, so the cost stays the same whether one resource or
+    a whole page of resources is handled. The free hours are then computed by
+    subtracting the reservations from the opening hours (or from the whole
+    range if during_closing=True).
+
+    :rtype: dict[str, list[dict[str, datetime.datetime]]]
+    :type resources: list[Resource]
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    :type duration: datetime.timedelta
+    :type reservation: Reservation
+    :type during_closing: bool
+    """
+    resources = list(resources)
+    if not resources:
+        return {}
+
+    open_by_resource = defaultdict(list)
+    if during_closing:
+        for resource in resources:
+            open_by_resource[resource.id].append((start, end))
+    else:
+        hours = ResourceDailyOpeningHours.objects.filter(
+            resource__in=resources, open_between__overlap=(start, end, '[)')
+        ).values_list('resource_id', 'open_between')
+        for resource_id, open_between in hours:
+            open_by_resource[resource_id].append((max(open_between.lower, start), min(open_between.upper, end)))
+
+    reservation_model = apps.get_model('resources', 'Reservation')
+    reservations = reservation_model.objects.filter(resource__in=resources, end__gt=start, begin__lt=end).current()
+    if reservation is not None and reservation.pk:
+        reservations = reservations.exclude(pk=reservation.pk)
+    busy_by_resource = defaultdict(list)
+    for resource_id, begin, res_end in reservations.values_list('resource_id', 'begin', 'end'):
+        busy_by_resource[resource_id].append((begin, res_end))
+
+    available_hours = {}
+    for resource in resources:
+        tz = resource.unit.get_tz() if resource.unit else timezone.get_current_timezone()
+        free = subtract_intervals(open_by_resource[resource.id], busy_by_resource[resource.id], duration)
+        available_hours[resource.id] = [
+            OrderedDict(starts=begin.astimezone(tz), ends=free_end.astimezone(tz)) for begin, free_end in free
+        ]
+    return available_hours
+
+
+def get_earliest_free_slots(resources, start, end, duration, limit, during_closing=False):
+    """
+    Returns the earliest times the given resources are free for the given duration
+
+    The free hours of all the resources are first searched for within one
+    day from start, and the search continues in windows that double the
+    searched range until enough slots are found or the end is reached. Each
+    window fetches the opening hours and reservations of its own part of the
+    range only. It starts duration before the end of the previous one, so
+    that free periods crossing the border are found, and every free slot
+    found in a window precedes the slots in the windows after it.
+
+    Returns a list of (starts, ends, resource) tuples, ordered by starts.
+    Each free period of a resource yields one slot, that ends after the
+    given duration.
+
+    :type resources: list[Resource]
+    :type start: datetime.datetime
+    :type end: datetime.datetime
+    :type duration: datetime.timedelta
+    :type limit: int
+    :type during_closing: bool
+    :rtype: list[tuple[datetime.datetime, datetime.datetime, Resource]]
+    """
+    resources = list(resources)
+    resources_by_id = {resource.id: resource for resource in resources}
+    slots = []
+    found = set()
+    # Resources whose last free period found reached the end of the previous window
+    continued = set()
+    window_start = start
+    search_days = 1
+    while True:
+        window_end = min(start + datetime.timedelta(days=search_days), end)
+        available_hours = get_available_hours_for_resources(
+            resources, window_start, window_end, duration, during_closing=during_closing
+        )
+        window_slots = []
+        next_continued = set()
+        for resource_id, resource_hours in available_hours.items():
+            for hours in resource_hours:
+                key = (hours['starts'], resource_id)
+                # A free period continuing from the previous window has been found already
+                if key in found or (hours['starts'] == window_start and resource_id in continued):
+                    continue
+                found.add(key)
+                window_slots.append(key)
+            if resource_hours and resource_hours[-1]['ends'] == window_end:
+                next_continued.add(resource_id)
+        for starts, resource_id in heapq.nsmallest(limit - len(slots), window_slots):
+            slots.append((starts, starts + duration, resources_by_id[resource_id]))
+        if len(slots) >= limit or window_end >= end:
+            return slots
+        continued = next_continued
+        window_start = max(window_end - duration, start)
+        search_days *= 2
+
+
+def _get_periods_hours(time_zone, periods, begin, end):
+    """
+    Returns opening and closing times by date for the dates covered by the given periods
+
+    Dates the periods say are closed are included with a None value.
+
+    :rtype: dict[datetime.date, tuple[datetime.datetime, datetime.datetime] | None]
+    """
+    if not periods:
+        return {}
+
+    earliest_date = min(period.start for period in periods)
+    latest_date = max(period.end for period in periods)
+    if begin is not None:
+        earliest_date = max(earliest_date, begin)
+    if end is not None:
+        latest_date = min(latest_date, end)
+    if earliest_date > latest_date:
+        return {}
+
+    covered = bytearray((latest_date - earliest_date).days + 1)
+    for period in periods:
+        first = max((period.start - earliest_date).days, 0)
+        last = min((period.end - earliest_date).days, len(covered) - 1)
+        if first <= last:
+            covered[first:last + 1] = b'\x01' * (last - first + 1)
+
+    periods_hours = {}
+    for date, hours_items in get_opening_hours(time_zone, periods, earliest_date, latest_date).items():
+        if not covered[(date - earliest_date).days]:
+            continue
+        for h in hours_items:
+            periods_hours[date] = (h['opens'], h['closes']) if h['opens'] and h['closes'] else None
+    return periods_hours
+
+
+def _get_opening_hours_sources(unit, resources, begin, end):
+    """
+    Fetch the existing opening hours and the periods of the unit and the resources within the window
+
+    :rtype: tuple[django.db.models.QuerySet, list[Period], list[Period]]
+    """
+    period_model = apps.get_model('resources', 'Period')
+    tz = unit.get_tz()
+    hours = ResourceDailyOpeningHours.objects.filter(resource__in=resources)
+    unit_periods = unit.periods.all()
+    resource_periods = period_model.objects.filter(resource__in=resources)
+    if begin is not None:
+        hours = hours.filter(open_between__startswith__gte=combine_datetime(begin, datetime.time.min, tz))
+        unit_periods = unit_periods.filter(end__gte=begin)
+        resource_periods = resource_periods.filter(end__gte=begin)
+    if end is not None:
+        day_after_end = end + datetime.timedelta(days=1)
+        hours = hours.filter(open_between__startswith__lt=combine_datetime(day_after_end, datetime.time.min, tz))
+        unit_periods = unit_periods.filter(start__lte=end)
+        resource_periods = resource_periods.filter(start__lte=end)
+    return hours, list(unit_periods), list(resource_periods)
+
+
+def _merge_resources_opening_hours(unit, resources, unit_periods, resource_periods, begin, end):
+    """
+    Compute the opening hours of the resources from the unit's periods and their own ones
+
+    :rtype: dict[tuple[str, datetime.datetime], datetime.datetime]
+    """
+    # The stored hours must not come from schedules compiled by another process before a change
+    compile_periods(unit_periods + resource_periods, reuse=False)
+
+    unit_hours = _get_periods_hours(unit.time_zone, unit_periods, begin, end)
+    periods_by_resource = defaultdict(list)
+    for period in resource_periods:
+        periods_by_resource[period.resource_id].append(period)
+
+    new_hours = {}
+    for resource in resources:
+        resource_hours = unit_hours
+        own_periods = periods_by_resource[resource.id]
+        if own_periods:
+            resource_hours = dict(unit_hours)
+            resource_hours.update(_get_periods_hours(unit.time_zone, own_periods, begin, end))
+        for opens_closes in resource_hours.values():
+            if opens_closes is not None:
+                opens, closes = opens_closes
+                new_hours[(resource.id, opens)] = closes
+    return new_hours
+
+
+def _write_resources_opening_hours(resources, hours, new_hours):
+    """
+    Replace the existing opening hours that differ from the new ones
+    """
+    # Assume we delete everything, but leave out the items that have
+    # identical hours.
+    to_delete = []
+    existing_hours = {}
+    for pk, resource_id, open_between in hours.values_list('pk', 'resource_id', 'open_between'):
+        key = (resource_id, open_between.lower)
+        if key in existing_hours or new_hours.get(key) != open_between.upper:
+            to_delete.append(pk)
+        else:
+            existing_hours[key] = open_between.upper
+
+    if to_delete:
+        ResourceDailyOpeningHours.objects.filter(pk__in=to_delete).delete()
+
+    add_objs = [
+        ResourceDailyOpeningHours(resource_id=resource_id, open_between=(opens, closes, '[)'))
+        for (resource_id, opens), closes in new_hours.items()
+        if (resource_id, opens) not in existing_hours
+    ]
+    if add_objs:
+        ResourceDailyOpeningHours.objects.bulk_create(add_objs)
+    if to_delete or add_objs:
+        # The rows were bulk created, which sends no signals
+        invalidate_resource_list_cache()
+        for resource in resources:
+            if resource._opening_hours_memo is not None:
+                resource.memoize_opening_hours()
+
+
+def update_opening_hours_for_resources(unit, resources, begin=None, end=None):
+    """
+    Recompute the daily opening hours of the given resources of a unit
+
+    The schedule defined by the unit's periods is computed only once and
+    shared by all the resources. Periods set for a resource always carry a
+    higher priority, so only the dates covered by the resource's own periods
+    are computed separately for it. The results are then compared against
+    the existing opening hours of all the resources at once.
+
+    If begin and/or end dates are given, only the dates within that window
+    (inclusive) are recomputed.
+
+    :type unit: Unit
+    :type resources: list[Resource]
+    :type begin: datetime.date | None
+    :type end: datetime.date | None
+    """
+    resources = list(resources)
+    if not resources:
+        return
+
+    hours, unit_periods, resource_periods = _get_opening_hours_sources(unit, resources, begin, end)
+    new_hours = _merge_resources_opening_hours(unit, resources, unit_periods, resource_periods, begin, end)
+    _write_resources_opening_hours(resources, hours, new_hours)
+
+
+RESERVATION_VALIDATION_HOURS_SQL = """
+SELECT ARRAY(
+    SELECT hours.open_between FROM {hours_table} hours
+    WHERE hours.resource_id = {resource_table}.id AND hours.open_between && tstzrange(%s, %s, '[)')
+    ORDER BY hours.open_between
+)
+"""
+
+
+def load_reservation_validation_data(resource, user, begin, end, reservation=None):
+    """
+    Load what validating a reservation of the resource needs into the resource, in one query
+
+    The query fetches the user's authorizations to the unit of the resource,
+    whether any active reservation other than the given one overlaps begin
+    and end, and the opening hours around them. Resource.is_admin(),
+    is_manager(), check_reservation_collision() and get_opening_hours() use
+    the loaded data when they are asked about the same user and times.
+
+    :type resource: Resource
+    :type user: users.models.User
+    :type begin: datetime.datetime
+    :type end: datetime.datetime
+    :type reservation: Reservation | None
+    """
+    reservation_model = apps.get_model('resources', 'Reservation')
+    unit_authorization_model = apps.get_model('resources', 'UnitAuthorization')
+    unit_group_authorization_model = apps.get_model('resources', 'UnitGroupAuthorization')
+
+    overlapping = reservation_model.objects.filter(
+        resource=dbm.OuterRef('pk'), end__gt=begin, begin__lt=end
+    ).active()
+    if reservation is not None:
+        overlapping = overlapping.exclude(pk=reservation.pk)
+    annotations = dict(
+        has_collision=dbm.Exists(overlapping),
+        # Opening hours starting on the local dates of begin and end are within a day of them in any time zone
+        opening_hours=RawSQL(RESERVATION_VALIDATION_HOURS_SQL.format(
+            hours_table=ResourceDailyOpeningHours._meta.db_table,
+            resource_table=Resource._meta.db_table,
+        ), (begin - datetime.timedelta(days=1), end + datetime.timedelta(days=1))),
+    )
+    if is_authenticated_user(user):
+        unit_authorizations = unit_authorization_model.objects.filter(subject=dbm.OuterRef('unit'), authorized=user)
+        unit_group_authorizations = unit_group_authorization_model.objects.filter(
+            subject__members=dbm.OuterRef('unit'), authorized=user
+        )
+        annotations.update(
+            is_unit_admin=dbm.Exists(unit_authorizations.admin_level()),
+            is_unit_group_admin=dbm.Exists(unit_group_authorizations.admin_level()),
+            is_unit_manager=dbm.Exists(unit_authorizations.manager_level()),
+        )
+    # Only the annotations are fetched, the resource itself has been loaded already
+    loaded = Resource.objects.filter(pk=resource.pk).annotate(
+        **{'validation_%s' % name: value for name, value in annotations.items()}
+    ).values(*('validation_%s' % name for name in annotations)).get()
+    loaded = {name: loaded['validation_%s' % name] for name in annotations}
+
+    validation_data = dict(user=user, begin=begin, end=end, reservation=reservation,
+                           has_collision=loaded['has_collision'])
+    if is_authenticated_user(user):
+        is_unit_admin = loaded['is_unit_admin'] or loaded['is_unit_group_admin']
+        validation_data.update(
+            is_unit_admin=is_unit_admin,
+            is_unit_manager=is_unit_admin or loaded['is_unit_manager'],
+        )
+    resource._reservation_validation_data = validation_data
+
+    if resource.unit:
+        # Seed the opening hours memo with the hours the validators ask for
+        resource.memoize_opening_hours()
+        tz = resource.get_tz()
+        hours_begin, hours_end = determine_hours_time_range(begin.astimezone(tz).date(), end.astimezone(tz).date(), tz)
+        hours_objs = [
+            ResourceDailyOpeningHours(resource=resource, open_between=open_between)
+            for open_between in loaded['opening_hours']
+            if open_between.lower < hours_end and open_between.upper > hours_begin
+        ]
+        resource._opening_hours_memo[(hours_begin, hours_end)] = resource._get_opening_hours(
+            tz, hours_begin, hours_end, hours_objs
+        )
+
+
 class ResourceType(ModifiableModel, AutoIdentifiedModel):
     MAIN_TYPES = (
         ('space', _('Space')),
@@ -129,6 +476,83 @@ class TermsOfUse(ModifiableModel, AutoIdentifiedModel):
         return get_translated_name(self)
 
 
+# Finds the ids of resources that have a gap of at least the given period
+# between reservations within their opening hours on the given range. The
+# gap before each reservation is measured from the latest end of the
+# earlier reservations, or from the opening time for the first one.
+FREE_PERIOD_RESOURCE_IDS_SQL = """
+WITH hours AS (
+    SELECT id, resource_id,
+           GREATEST(lower(open_between), %s) AS opens,
+           LEAST(upper(open_between), %s) AS closes
+    FROM {hours_table}
+    WHERE open_between && tstzrange(%s, %s, '[)')
+), reserved AS (
+    SELECT hours.id AS hours_id, hours.resource_id, hours.opens, hours.closes,
+           GREATEST(reservation.begin, hours.opens) AS begins,
+           LEAST(reservation."end", hours.closes) AS ends
+    FROM hours
+    JOIN {reservation_table} reservation ON reservation.resource_id = hours.resource_id
+    WHERE reservation.begin < hours.closes AND reservation."end" > hours.opens
+      AND reservation.state NOT IN (%s, %s)
+), gaps AS (
+    SELECT resource_id,
+           begins - COALESCE(MAX(ends) OVER (
+               PARTITION BY hours_id ORDER BY begins ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+           ), opens) AS length
+    FROM reserved
+    UNION ALL
+    SELECT resource_id, MAX(closes) - MAX(ends) AS length
+    FROM reserved
+    GROUP BY hours_id, resource_id
+    UNION ALL
+    SELECT resource_id, closes - opens AS length
+    FROM hours
+    WHERE NOT EXISTS (SELECT 1 FROM reserved WHERE reserved.hours_id = hours.id)
+)
+SELECT resource_id FROM gaps WHERE length >= %s
+"""
+
+
+# Text search configuration of each language of the translated fields
+SEARCH_CONFIGS = OrderedDict([('fi', 'finnish'), ('sv', 'swedish'), ('en', 'english')])
+
+# Builds the full text search documents of the given resources from the
+# names of the resources and their units and the descriptions of the
+# resources, weighted in that order, in each language.
+UPDATE_SEARCH_DOCUMENTS_SQL = """
+UPDATE {resource_table} AS resource SET search_document =
+    setweight(to_tsvector('finnish', COALESCE(resource.name_fi, '')), 'A') ||
+    setweight(to_tsvector('swedish', COALESCE(resource.name_sv, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(resource.name_en, '')), 'A') ||
+    setweight(to_tsvector('finnish', COALESCE(unit.name_fi, '')), 'B') ||
+    setweight(to_tsvector('swedish', COALESCE(unit.name_sv, '')), 'B') ||
+    setweight(to_tsvector('english', COALESCE(unit.name_en, '')), 'B') ||
+    setweight(to_tsvector('finnish', COALESCE(resource.description_fi, '')), 'C') ||
+    setweight(to_tsvector('swedish', COALESCE(resource.description_sv, '')), 'C') ||
+    setweight(to_tsvector('english', COALESCE(resource.description_en, '')), 'C')
+FROM {resource_table} AS resource_with_unit
+LEFT JOIN {unit_table} AS unit ON unit.id = resource_with_unit.unit_id
+WHERE resource_with_unit.id = resource.id AND resource.id = ANY(%s)
+"""
+
+
+def update_search_documents(resource_ids):
+    """
+    Update the full text search documents of the given resources
+
+    :type resource_ids: list[str]
+    """
+    resource_ids = list(resource_ids)
+    if not resource_ids:
+        return
+    sql = UPDATE_SEARCH_DOCUMENTS_SQL.format(
+        resource_table=Resource._meta.db_table, unit_table=Unit._meta.db_table,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [resource_ids])
+
+
 class ResourceQuerySet(models.QuerySet):
     def visible_for(self, user):
         if is_general_admin(user):
@@ -154,6 +578,37 @@ class ResourceQuerySet(models.QuerySet):
                                                with_superuser=False)
         return self.filter(Q(unit__in=units) | Q(groups__in=resource_groups)).distinct()
 
+    def free_for_period(self, start, end, period):
+        """
+        Filter resources that are open and unreserved for at least the given period between start and end
+
+        The free time is searched for in the database: each reservation is
+        clipped to the opening hours within the range and compared against
+        the latest end of the reservations before it, so only the ids of the
+        matching resources are ever returned from the database.
+
+        :type start: datetime.datetime
+        :type end: datetime.datetime
+        :type period: datetime.timedelta
+        """
+        reservation_model = apps.get_model('resources', 'Reservation')
+        sql = FREE_PERIOD_RESOURCE_IDS_SQL.format(
+            hours_table=ResourceDailyOpeningHours._meta.db_table,
+            reservation_table=reservation_model._meta.db_table,
+        )
+        params = (start, end, start, end, reservation_model.CANCELLED, reservation_model.DENIED, period)
+        return self.filter(id__in=RawSQL(sql, params))
+
+    def update_search_documents(self):
+        update_search_documents(self.values_list('id', flat=True))
+
+    def update_opening_hours(self, begin=None, end=None):
+        resources_by_unit = defaultdict(list)
+        for resource in self.filter(unit__isnull=False).select_related('unit'):
+            resources_by_unit[resource.unit].append(resource)
+        for unit, resources in resources_by_unit.items():
+            update_opening_hours_for_resources(unit, resources, begin, end)
+
 
 class Resource(ModifiableModel, AutoIdentifiedModel):
     AUTHENTICATION_TYPES = (
@@ -186,6 +641,8 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
 
     # if not set, location is inherited from unit
     location = models.PointField(verbose_name=_('Location'), null=True, blank=True, srid=settings.DEFAULT_SRID)
+    # location or else the location of the unit, maintained for spatially indexed queries
+    effective_location = models.PointField(null=True, editable=False, srid=settings.DEFAULT_SRID, geography=True)
 
     min_period = models.DurationField(verbose_name=_('Minimum reservation time'),
                                       default=datetime.timedelta(minutes=30))
@@ -234,13 +691,30 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         help_text=_('A link to an external reservation system if this resource is managed elsewhere'),
         null=True, blank=True)
     reservation_extra_questions = models.TextField(verbose_name=_('Reservation extra questions'), blank=True)
+    # Maintained by update_search_documents()
+    search_document = SearchVectorField(null=True, editable=False)
 
     objects = ResourceQuerySet.as_manager()
 
+    # The fields the search document is built from, see UPDATE_SEARCH_DOCUMENTS_SQL
+    search_document_fields = ('unit_id',) + tuple(
+        '%s_%s' % (field, lang) for field in ('name', 'description') for lang in SEARCH_CONFIGS
+    )
+
+    # Set by memoize_opening_hours()
+    _opening_hours_memo = None
+    # Values of search_document_fields as loaded from the database
+    _search_document_values = None
+    # Set by load_reservation_validation_data()
+    _reservation_validation_data = None
+
     class Meta:
         verbose_name = _("resource")
         verbose_name_plural = _("resources")
         ordering = ('unit', 'name',)
+        indexes = [
+            GinIndex(fields=['search_document'], name='resources_resource_search'),
+        ]
 
     def __str__(self):
         return "%s (%s)/%s" % (get_translated(self, 'name'), self.id, self.unit)
@@ -277,7 +751,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         if self.is_admin(user):
             return
 
-        tz = self.unit.get_tz()
+        tz = self.get_tz()
         # check if data from serializer is present:
         if data:
             begin = data['begin']
@@ -328,6 +802,12 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
                 raise ValidationError(_("Maximum number of active reservations for this resource exceeded."))
 
     def check_reservation_collision(self, begin, end, reservation):
+        data = self._reservation_validation_data
+        if data is not None and (data['begin'], data['end'], data['reservation']) == (begin, end, reservation):
+            return data['has_collision']
+        # The occupancy bitmaps can only tell for sure that there is no collision
+        if is_reserved_by_occupancy(self, begin, end) is False:
+            return False
         overlapping = self.reservations.filter(end__gt=begin, begin__lt=end).active()
         if reservation:
             overlapping = overlapping.exclude(pk=reservation.pk)
@@ -337,7 +817,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         """
         Returns hours that the resource is not reserved for a given date range
 
-        If include_closed=True, will also return hours when the resource is closed, if it is not reserved.
+        If during_closing=True, will also return hours when the resource is closed, if it is not reserved.
         This is so that admins can book resources during closing hours. Returns
         the available hours as a list of dicts. The optional reservation argument
         is for disregarding a given reservation during checking, if we wish to
@@ -364,61 +844,27 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
             start = tz.localize(start)
             end = tz.localize(end)
 
-        if not during_closing:
-            """
-            Check open hours only
-            """
-            open_hours = self.get_opening_hours(start, end)
-            hours_list = []
-            for date, open_during_date in open_hours.items():
-                for period in open_during_date:
-                    if period['opens']:
-                        # if the start or end straddle opening hours
-                        opens = period['opens'] if period['opens'] > start else start
-                        closes = period['closes'] if period['closes'] < end else end
-                        # include_closed to prevent recursion, opening hours need not be rechecked
-                        hours_list.extend(self.get_available_hours(start=opens,
-                                                                   end=closes,
-                                                                   duration=duration,
-                                                                   reservation=reservation,
-                                                                   during_closing=True))
-            return hours_list
-
-        reservations = self.reservations.filter(
-            end__gte=start, begin__lte=end).order_by('begin')
-        hours_list = [({'starts': start})]
-        first_checked = False
-        for res in reservations:
-            # skip the reservation that is being edited
-            if res == reservation:
-                continue
-            # check if the reservation spans the beginning
-            if not first_checked:
-                first_checked = True
-                if res.begin < start:
-                    if res.end > end:
-                        return []
-                    hours_list[0]['starts'] = res.end
-                    # proceed to the next reservation
-                    continue
-            if duration:
-                if res.begin - hours_list[-1]['starts'] < duration:
-                    # the free period is too short, discard this period
-                    hours_list[-1]['starts'] = res.end
-                    continue
-            hours_list[-1]['ends'] = timezone.localtime(res.begin)
-            # check if the reservation spans the end
-            if res.end > end:
-                return hours_list
-            hours_list.append({'starts': timezone.localtime(res.end)})
-        # after the last reservation, we must check if the remaining free period is too short
-        if duration:
-            if end - hours_list[-1]['starts'] < duration:
-                hours_list.pop()
-                return hours_list
-        # otherwise add the remaining free period
-        hours_list[-1]['ends'] = end
-        return hours_list
+        hours = get_available_hours_for_resources([self], start, end, duration=duration,
+                                                  reservation=reservation, during_closing=during_closing)
+        return hours[self.id]
+
+    def memoize_opening_hours(self):
+        """
+        Remember the opening hours and the time zone of this resource instance
+
+        Meant for the validation of a single request, where several validators
+        need the same opening hours. The memo lives only as long as the
+        instance, and it is cleared when the opening hours are updated.
+        """
+        self._opening_hours_memo = {}
+
+    def get_tz(self):
+        memo = self._opening_hours_memo
+        if memo is None:
+            return self.unit.get_tz()
+        if 'tz' not in memo:
+            memo['tz'] = self.unit.get_tz()
+        return memo['tz']
 
     def get_opening_hours(self, begin=None, end=None, opening_hours_cache=None):
         """
@@ -426,9 +872,17 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         :type begin: datetime.date
         :type end: datetime.date
         """
-        tz = pytz.timezone(self.unit.time_zone)
+        tz = self.get_tz()
         begin, end = determine_hours_time_range(begin, end, tz)
 
+        memo = self._opening_hours_memo
+        if opening_hours_cache is None and memo is not None:
+            if (begin, end) not in memo:
+                memo[(begin, end)] = self._get_opening_hours(tz, begin, end)
+            return memo[(begin, end)]
+        return self._get_opening_hours(tz, begin, end, opening_hours_cache)
+
+    def _get_opening_hours(self, tz, begin, end, opening_hours_cache=None):
         if opening_hours_cache is None:
             hours_objs = self.opening_hours.filter(open_between__overlap=(begin, end, '[)'))
         else:
@@ -453,62 +907,19 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
 
         return opening_hours
 
-    def update_opening_hours(self):
-        hours = self.opening_hours.order_by('open_between')
-        existing_hours = {}
-        for h in hours:
-            assert h.open_between.lower not in existing_hours
-            existing_hours[h.open_between.lower] = h.open_between.upper
-
-        unit_periods = list(self.unit.periods.all())
-        resource_periods = list(self.periods.all())
-
-        # Periods set for the resource always carry a higher priority. If
-        # nothing is defined for the resource for a given day, use the
-        # periods configured for the unit.
-        for period in unit_periods:
-            period.priority = 0
-        for period in resource_periods:
-            period.priority = 1
-
-        earliest_date = None
-        latest_date = None
-        all_periods = unit_periods + resource_periods
-        for period in all_periods:
-            if earliest_date is None or period.start < earliest_date:
-                earliest_date = period.start
-            if latest_date is None or period.end > latest_date:
-                latest_date = period.end
-
-        # Assume we delete everything, but remove items from the delete
-        # list if the hours are identical.
-        to_delete = existing_hours
-        to_add = {}
-        if all_periods:
-            hours = get_opening_hours(self.unit.time_zone, all_periods,
-                                      earliest_date, latest_date)
-            for hours_items in hours.values():
-                for h in hours_items:
-                    if not h['opens'] or not h['closes']:
-                        continue
-                    if h['opens'] in to_delete and h['closes'] == to_delete[h['opens']]:
-                            del to_delete[h['opens']]
-                            continue
-                    to_add[h['opens']] = h['closes']
-
-        if to_delete:
-            ret = ResourceDailyOpeningHours.objects.filter(
-                open_between__in=[(opens, closes, '[)') for opens, closes in to_delete.items()],
-                resource=self
-            ).delete()
-            assert ret[0] == len(to_delete)
-
-        add_objs = [
-            ResourceDailyOpeningHours(resource=self, open_between=(opens, closes, '[)'))
-            for opens, closes in to_add.items()
-        ]
-        if add_objs:
-            ResourceDailyOpeningHours.objects.bulk_create(add_objs)
+    def update_opening_hours(self, begin=None, end=None):
+        """
+        Recompute the daily opening hours of the resource from its periods
+
+        By default every date covered by the unit's or the resource's periods
+        is recomputed. If begin and/or end dates are given, only the dates
+        within that window (inclusive) are recomputed and compared against
+        the existing opening hours.
+
+        :type begin: datetime.date | None
+        :type end: datetime.date | None
+        """
+        update_opening_hours_for_resources(self.unit, [self], begin, end)
 
     def is_admin(self, user):
         """
@@ -521,6 +932,9 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         # so if this is changed those need to be changed as well.
         if not self.unit:
             return is_general_admin(user)
+        data = self._reservation_validation_data
+        if data is not None and 'is_unit_admin' in data and data['user'] == user:
+            return is_general_admin(user) or data['is_unit_admin']
         return self.unit.is_admin(user)
 
     def is_manager(self, user):
@@ -532,6 +946,9 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         """
         if not self.unit:
             return is_general_admin(user)
+        data = self._reservation_validation_data
+        if data is not None and 'is_unit_manager' in data and data['user'] == user:
+            return is_general_admin(user) or data['is_unit_manager']
         return self.unit.is_manager(user)
 
     def _has_perm(self, user, perm, allow_admin=True):
@@ -600,24 +1017,59 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
     def get_reservable_after(self):
         return create_datetime_days_from_now(self.get_reservable_min_days_in_advance())
 
+    def _get_reservation_metadata_set(self, cache=None):
+        if cache is None:
+            cache = get_reservation_metadata_sets()
+        metadata_set = cache.get(self.reservation_metadata_set_id)
+        if metadata_set is None:
+            # the set was created after the cache was loaded
+            metadata_set = self.reservation_metadata_set
+        return metadata_set
+
     def get_supported_reservation_extra_field_names(self, cache=None):
         if not self.reservation_metadata_set_id:
             return []
-        if cache:
-            metadata_set = cache[self.reservation_metadata_set_id]
-        else:
-            metadata_set = self.reservation_metadata_set
+        metadata_set = self._get_reservation_metadata_set(cache)
         return [x.field_name for x in metadata_set.supported_fields.all()]
 
     def get_required_reservation_extra_field_names(self, cache=None):
-        if not self.reservation_metadata_set:
+        if not self.reservation_metadata_set_id:
             return []
-        if cache:
-            metadata_set = cache[self.reservation_metadata_set_id]
-        else:
-            metadata_set = self.reservation_metadata_set
+        metadata_set = self._get_reservation_metadata_set(cache)
         return [x.field_name for x in metadata_set.required_fields.all()]
 
+    def get_effective_location(self):
+        if self.location is not None:
+            return self.location
+        return self.unit.location if self.unit_id else None
+
+    def save(self, *args, **kwargs):
+        # Conditional GETs of resources rely on the modification time being up to date
+        self.modified_at = timezone.now()
+        self.effective_location = self.get_effective_location()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'modified_at', 'effective_location'}
+        ret = super().save(*args, **kwargs)
+        if self._search_document_changed():
+            update_search_documents([self.id])
+        self._search_document_values = self._get_search_document_values()
+        return ret
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._search_document_values = instance._get_search_document_values()
+        return instance
+
+    def _get_search_document_values(self):
+        # Deferred fields are left out instead of fetching them
+        return {name: self.__dict__[name] for name in self.search_document_fields if name in self.__dict__}
+
+    def _search_document_changed(self):
+        if self._search_document_values is None:
+            return True
+        return self._get_search_document_values() != self._search_document_values
+
     def clean(self):
         if self.min_price_per_hour is not None and self.max_price_per_hour is not None:
             if self.min_price_per_hour > self.max_price_per_hour:
@@ -9,7 +9,7 @@ from enumfields import EnumField
 from ..auth import is_authenticated_user, is_general_admin
 from ..enums import UnitAuthorizationLevel
 from .base import AutoIdentifiedModel, ModifiableModel
-from .utils import create_datetime_days_from_now, get_translated, get_translated_name
+from .utils import create_datetime_days_from_now, get_translated, get_translated_name, get_tz
 from .availability import get_opening_hours
 from .permissions import UNIT_PERMISSIONS
 
@@ -98,12 +98,11 @@ class Unit(ModifiableModel, AutoIdentifiedModel):
         """
         return get_opening_hours(self.time_zone, list(self.periods.all()), begin, end)
 
-    def update_opening_hours(self):
-        for res in self.resources.all():
-            res.update_opening_hours()
+    def update_opening_hours(self, begin=None, end=None):
+        self.resources.update_opening_hours(begin, end)
 
     def get_tz(self):
-        return pytz.timezone(self.time_zone)
+        return get_tz(self.time_zone)
 
     def get_reservable_before(self):
         return create_datetime_days_from_now(self.reservable_max_days_in_advance)
@@ -1,12 +1,18 @@
 import base64
+import csv
 import datetime
+import functools
+import json
 import struct
+import tempfile
 import time
 import io
 import logging
 
 import arrow
+import pytz
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import formats
 from django.utils.translation import ungettext
 from django.core.mail import EmailMultiAlternatives
@@ -40,6 +46,43 @@ def get_dt(obj, attr, tz):
     return arrow.get(getattr(obj, attr)).to(tz).datetime
 
 
+@functools.lru_cache(maxsize=None)
+def get_tz(name):
+    """
+    Get the pytz time zone of the given name, looking each name up only once
+
+    :type name: str
+    """
+    return pytz.timezone(name)
+
+
+@functools.lru_cache(maxsize=8192)
+def get_local_datetime(tz, date, time):
+    """
+    Combine the date and time into a datetime localized to the given time zone
+
+    The results are memoized, as the same days of the same time zones get
+    localized over and over again when computing opening hours.
+
+    :type tz: datetime.tzinfo
+    :type date: datetime.date
+    :type time: datetime.time
+    :rtype: datetime.datetime
+    """
+    return tz.localize(datetime.datetime.combine(date, time))
+
+
+def get_local_midnight(tz, date):
+    """
+    Get the beginning of the given date in the given time zone
+
+    :type tz: datetime.tzinfo
+    :type date: datetime.date
+    :rtype: datetime.datetime
+    """
+    return get_local_datetime(tz, date, datetime.time(0, 0))
+
+
 def get_translated(obj, attr):
     key = "%s_%s" % (attr, DEFAULT_LANG)
     val = getattr(obj, key, None)
@@ -117,26 +160,10 @@ def send_respa_mail(email_address, subject, body, html_body=None, attachments=No
     msg.send()
 
 
-def generate_reservation_xlsx(reservations):
-    """
-    Return reservations in Excel xlsx format
-
-    The parameter is expected to be a list of dicts with fields:
-      * unit: unit name str
-      * resource: resource name str
-      * begin: begin time datetime
-      * end: end time datetime
-      * staff_event: is staff event bool
-      * user: user email str (optional)
-      * comments: comments str (optional)
-      * all of RESERVATION_EXTRA_FIELDS are optional as well
-
-    :rtype: bytes
-    """
+def _write_reservation_xlsx(output, reservations, options=None):
     from resources.models import Reservation, RESERVATION_EXTRA_FIELDS
 
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output)
+    workbook = xlsxwriter.Workbook(output, options or {})
     worksheet = workbook.add_worksheet()
 
     headers = [
@@ -174,9 +201,97 @@ def generate_reservation_xlsx(reservations):
             if field in reservation:
                 worksheet.write(row, i, reservation[field])
     workbook.close()
+
+
+def generate_reservation_xlsx(reservations):
+    """
+    Return reservations in Excel xlsx format
+
+    The parameter is expected to be a list of dicts with fields:
+      * unit: unit name str
+      * resource: resource name str
+      * begin: begin time datetime
+      * end: end time datetime
+      * staff_event: is staff event bool
+      * user: user email str (optional)
+      * comments: comments str (optional)
+      * all of RESERVATION_EXTRA_FIELDS are optional as well
+
+    :rtype: bytes
+    """
+    output = io.BytesIO()
+    _write_reservation_xlsx(output, reservations)
     return output.getvalue()
 
 
+def generate_reservation_xlsx_file(reservations):
+    """
+    Return reservations in Excel xlsx format as a temporary file
+
+    The reservations are dicts as with generate_reservation_xlsx(). The rows
+    are written in xlsxwriter's constant memory mode, so the reservations can
+    be given as an iterator of any length without holding them in memory.
+    The file is positioned at its beginning and deleted when closed.
+
+    :rtype: file
+    """
+    output = tempfile.TemporaryFile()
+    _write_reservation_xlsx(output, reservations, {'constant_memory': True})
+    output.seek(0)
+    return output
+
+
+def get_reservation_export_fields():
+    from resources.models import RESERVATION_EXTRA_FIELDS
+
+    return [
+        'id', 'unit', 'resource', 'begin', 'end', 'created_at', 'state', 'staff_event', 'user', 'comments',
+    ] + list(RESERVATION_EXTRA_FIELDS)
+
+
+def _format_export_row(reservation):
+    return {
+        key: localtime(value).isoformat() if isinstance(value, datetime.datetime) else value
+        for key, value in reservation.items()
+    }
+
+
+class _Echo:
+    """ File-like object that returns what is written to it, for making one line at a time """
+    def write(self, value):
+        return value
+
+
+def generate_reservation_csv(reservations):
+    """
+    Generate the lines of reservations in CSV format
+
+    The reservations are dicts with the fields of get_reservation_export_fields(),
+    of which the missing ones are left empty. Both the reservations and the
+    lines are iterated lazily, so the export can be streamed.
+
+    :rtype: collections.Iterable[str]
+    """
+    fields = get_reservation_export_fields()
+    writer = csv.DictWriter(_Echo(), fields, restval='', extrasaction='ignore')
+    yield writer.writerow(dict(zip(fields, fields)))
+    for reservation in reservations:
+        yield writer.writerow(_format_export_row(reservation))
+
+
+def generate_reservation_ndjson(reservations):
+    """
+    Generate the lines of reservations in newline delimited JSON format
+
+    Each line is a JSON object of a reservation dict, lazily as with
+    generate_reservation_csv().
+
+    :rtype: collections.Iterable[str]
+    """
+    for reservation in reservations:
+        yield json.dumps(_format_export_row(reservation), cls=DjangoJSONEncoder) + '\n'
+
+
 def get_object_or_none(cls, **kwargs):
     try:
         return cls.objects.get(**kwargs)
@@ -1,4 +1,14 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class DefaultPagination(PageNumberPagination):
@@ -12,17 +22,108 @@ class PurposePagination(DefaultPagination):
 
 
 class ReservationPagination(DefaultPagination):
+    """
+    Page number pagination, or keyset pagination when requested
+
+    Keyset pagination is started with ?pagination=cursor and continued by
+    following the next links, which have a cursor parameter pointing just
+    past the (begin, id) of the last reservation on the page. Reservations
+    are then always ordered by begin and id, and no count of all the
+    matching reservations is made, so the whole history can be walked
+    through in linear time.
+    """
+    pagination_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+    # Spreadsheet exports are paginated too, but may have much larger pages
+    export_format = 'xlsx'
+    export_max_page_size = 50000
+
+    def is_export_requested(self, request):
+        renderer = getattr(request, 'accepted_renderer', None)
+        return (getattr(renderer, 'format', None) == self.export_format or
+                request.query_params.get('format', '').lower() == self.export_format)
+
     def get_page_size(self, request):
-        if self.page_size_query_param:
-            cutoff = self.max_page_size
-            if request.query_params.get('format', '').lower() == 'xlsx':
-                cutoff = 50000
-            try:
-                return _positive_int(
-                    request.query_params[self.page_size_query_param],
-                    strict=True, cutoff=cutoff
-                )
-            except (KeyError, ValueError):
-                pass
-
-        return self.page_size
+        if not self.is_export_requested(request):
+            return super().get_page_size(request)
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True, cutoff=self.export_max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_export_page(self, queryset, request):
+        """
+        Get the requested page of a spreadsheet export as a sliced queryset
+
+        Unlike paginate_queryset(), this neither counts the matching rows nor
+        fetches the page, so that the export can go through it in chunks.
+
+        :type queryset: django.db.models.QuerySet
+        :rtype: django.db.models.QuerySet
+        """
+        page_size = self.get_page_size(request)
+        try:
+            page_number = _positive_int(request.query_params.get(self.page_query_param, 1), strict=True)
+        except ValueError:
+            raise NotFound(_('Invalid page.'))
+        offset = (page_number - 1) * page_size
+        return queryset[offset:offset + page_size]
+
+    def is_keyset_requested(self, request):
+        return (request.query_params.get(self.pagination_query_param) == 'cursor' or
+                self.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset_requested(request)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('begin', 'id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            begin, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(begin__gt=begin) | Q(begin=begin, id__gt=pk))
+
+        # One extra row tells whether there is a next page
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        return self.page
+
+    def encode_cursor(self, reservation):
+        position = '%s|%s' % (reservation.begin.isoformat(), reservation.id)
+        return base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            begin, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+            begin = parse_datetime(begin)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if begin is None:
+            raise NotFound(self.invalid_cursor_message)
+        return begin, pk
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.pagination_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
@@ -0,0 +1,191 @@
+"""
+Response caches for anonymous resource listings and typeahead suggestions, and ETags of conditional GETs
+
+Anonymous users mostly browse the same few filter combinations, so the
+serialized resource listings are cached for them, keyed by the host, the
+language and the normalized query parameters. The keys include a generation
+token that is replaced whenever anything shown in the listing changes, which
+makes all the cached listings obsolete at once. Data that depends on the
+current time, such as reservable_before, is covered by the cache timeout.
+Reservations change all the time, so listings that depend on them, those
+filtered by availability or showing reservations and available hours,
+are not cached at all.
+
+The cache is enabled with the RESPA_RESOURCE_LIST_CACHE_ENABLED setting and
+its timeout in seconds is RESPA_RESOURCE_LIST_CACHE_TIMEOUT. As with the
+occupancy bitmaps, the cache selected by RESPA_RESOURCE_LIST_CACHE should be
+shared by all the processes serving the API.
+
+Typeahead suggestions are requested at keystroke rate, so they are cached
+for a short while (RESPA_TYPEAHEAD_CACHE_TIMEOUT seconds) in the same cache,
+with a generation token of their own that is replaced when resources or
+units change. The cache can be turned off with RESPA_TYPEAHEAD_CACHE_ENABLED.
+
+The ETags of resource and reservation responses are made of the generation
+token of the resource listings along with two more: one replaced whenever
+reservations change and one whenever what users are allowed to do or their
+favorites change. Conditional GETs are enabled with the
+RESPA_CONDITIONAL_GET_ENABLED setting, which also requires a shared cache.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import translation
+
+from .auth import is_authenticated_user
+
+GENERATION_KEY = 'resource-list-generation'
+DEFAULT_TIMEOUT = 60
+TYPEAHEAD_GENERATION_KEY = 'typeahead-generation'
+RESERVATION_GENERATION_KEY = 'reservation-generation'
+USER_DATA_GENERATION_KEY = 'user-data-generation'
+DEFAULT_TYPEAHEAD_TIMEOUT = 30
+
+# Query parameters of the resource listing whose results depend on reservations
+RESERVATION_DEPENDENT_PARAMETERS = ('available_between', 'start', 'end')
+
+
+def is_resource_list_cache_enabled():
+    return getattr(settings, 'RESPA_RESOURCE_LIST_CACHE_ENABLED', False)
+
+
+def is_conditional_get_enabled():
+    return getattr(settings, 'RESPA_CONDITIONAL_GET_ENABLED', False)
+
+
+def _get_cache():
+    return caches[getattr(settings, 'RESPA_RESOURCE_LIST_CACHE', 'default')]
+
+
+def _get_generation(cache, key=GENERATION_KEY):
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def _set_new_generation(key=GENERATION_KEY):
+    _get_cache().set(key, uuid.uuid4().hex, None)
+
+
+def invalidate_resource_list_cache():
+    """
+    Make all the cached resource listings obsolete
+
+    The generation is replaced right away and once more after the current
+    transaction is committed, so that listings cached from data read before
+    the commit are not served after it.
+    """
+    if not is_resource_list_cache_enabled() and not is_conditional_get_enabled():
+        return
+    _set_new_generation()
+    transaction.on_commit(_set_new_generation)
+
+
+def get_resource_list_cache_key(request):
+    """
+    Get the cache key of the resource listing for the request, or None if it mustn't be cached
+
+    :type request: rest_framework.request.Request
+    :rtype: str | None
+    """
+    if not is_resource_list_cache_enabled():
+        return None
+    if request.method != 'GET' or is_authenticated_user(request.user):
+        return None
+    if any(name in request.query_params for name in RESERVATION_DEPENDENT_PARAMETERS):
+        return None
+
+    params = sorted((key, values) for key, values in request.query_params.lists())
+    parts = [request.get_host(), translation.get_language() or '', repr(params)]
+    digest = hashlib.sha1('\n'.join(parts).encode('utf8')).hexdigest()
+    return 'resource-list:%s:%s' % (_get_generation(_get_cache()), digest)
+
+
+def get_cached_resource_list(key):
+    return _get_cache().get(key)
+
+
+def set_cached_resource_list(key, data):
+    timeout = getattr(settings, 'RESPA_RESOURCE_LIST_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    _get_cache().set(key, data, timeout)
+
+
+def is_typeahead_cache_enabled():
+    return getattr(settings, 'RESPA_TYPEAHEAD_CACHE_ENABLED', True)
+
+
+def invalidate_typeahead_cache():
+    """
+    Make all the cached typeahead suggestions obsolete, now and after the current transaction
+    """
+    if not is_typeahead_cache_enabled():
+        return
+    _set_new_generation(TYPEAHEAD_GENERATION_KEY)
+    transaction.on_commit(lambda: _set_new_generation(TYPEAHEAD_GENERATION_KEY))
+
+
+def get_typeahead_cache_key(obj_name, query_parts, full, visibility):
+    """
+    Get the cache key of the typeahead suggestions of one object type, or None if they mustn't be cached
+
+    :type obj_name: str
+    :type query_parts: list[str]
+    :type full: bool
+    :param visibility: which objects the user can see, see TypeaheadViewSet.get_visibility_class()
+    :type visibility: str
+    :rtype: str | None
+    """
+    if not is_typeahead_cache_enabled():
+        return None
+    parts = [obj_name, ' '.join(query_parts), str(full), visibility, translation.get_language() or '']
+    digest = hashlib.sha1('\n'.join(parts).encode('utf8')).hexdigest()
+    return 'typeahead:%s:%s' % (_get_generation(_get_cache(), TYPEAHEAD_GENERATION_KEY), digest)
+
+
+def get_cached_typeahead(key):
+    return _get_cache().get(key)
+
+
+def set_cached_typeahead(key, data):
+    timeout = getattr(settings, 'RESPA_TYPEAHEAD_CACHE_TIMEOUT', DEFAULT_TYPEAHEAD_TIMEOUT)
+    _get_cache().set(key, data, timeout)
+
+
+def _invalidate_generation(key):
+    _set_new_generation(key)
+    transaction.on_commit(lambda: _set_new_generation(key))
+
+
+def invalidate_reservation_data():
+    """
+    Make the ETags of the responses showing reservations obsolete, now and after the current transaction
+    """
+    if is_conditional_get_enabled():
+        _invalidate_generation(RESERVATION_GENERATION_KEY)
+
+
+def invalidate_user_data():
+    """
+    Make the ETags of the responses showing what users may do obsolete, now and after the current transaction
+    """
+    if is_conditional_get_enabled():
+        _invalidate_generation(USER_DATA_GENERATION_KEY)
+
+
+def get_data_fingerprint():
+    """
+    Get the generation tokens of all the data resource and reservation responses show, or None if disabled
+
+    :rtype: tuple[str, str, str] | None
+    """
+    if not is_conditional_get_enabled():
+        return None
+    cache = _get_cache()
+    return tuple(
+        _get_generation(cache, key) for key in (GENERATION_KEY, RESERVATION_GENERATION_KEY, USER_DATA_GENERATION_KEY)
+    )
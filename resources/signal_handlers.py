@@ -0,0 +1,139 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from resources.models import (
+    AccessibilityViewpoint, Day, Equipment, Period, Purpose, Reservation, ReservationMetadataField,
+    ReservationMetadataSet, Resource, ResourceAccessibility, ResourceDailyOpeningHours, ResourceEquipment,
+    ResourceGroup, ResourceImage, ResourceType, TermsOfUse, Unit, UnitAccessibility, UnitAuthorization, UnitGroup,
+    UnitGroupAuthorization
+)
+from resources.models.availability import is_period_schedule_cache_enabled
+from resources.models.lookup_cache import (
+    ACCESSIBILITY_VIEWPOINTS, PERIOD_SCHEDULES, RESERVATION_METADATA_SETS, invalidate_lookup
+)
+from resources.models.occupancy import invalidate_occupancy
+from resources.response_cache import (
+    invalidate_reservation_data, invalidate_resource_list_cache, invalidate_typeahead_cache, invalidate_user_data
+)
+
+# Models whose changes show in the resource listing. Reservations are left out, as
+# the listings that depend on them are not cached.
+RESOURCE_LIST_MODELS = (
+    Equipment, Purpose, ReservationMetadataSet, Resource, ResourceAccessibility, ResourceDailyOpeningHours,
+    ResourceEquipment, ResourceGroup, ResourceImage, ResourceType, TermsOfUse, Unit, UnitAccessibility,
+)
+# Models whose changes show in what users may do with resources and reservations
+USER_DATA_MODELS = (
+    GroupObjectPermission, UnitAuthorization, UnitGroup, UnitGroupAuthorization, UserObjectPermission,
+)
+
+
+@receiver(post_save, sender=Reservation, dispatch_uid='reservation-occupancy-save')
+@receiver(post_delete, sender=Reservation, dispatch_uid='reservation-occupancy-delete')
+def handle_reservation_occupancy_change(sender, instance, **kwargs):
+    # A reservation moved to another resource leaves extra reserved slots on
+    # the old resource, which only makes the bitmaps fall back to the database.
+    invalidate_occupancy([instance.resource_id])
+
+
+@receiver(post_save, sender=Unit, dispatch_uid='unit-search-documents')
+def handle_unit_search_document_change(sender, instance, **kwargs):
+    # Unit names are a part of the search documents of its resources
+    instance.resources.all().update_search_documents()
+
+
+@receiver(post_save, sender=Unit, dispatch_uid='unit-effective-location')
+def handle_unit_location_change(sender, instance, **kwargs):
+    # Resources without a location of their own are located at their unit
+    instance.resources.filter(location__isnull=True).update(
+        effective_location=instance.location, modified_at=timezone.now()
+    )
+
+
+def handle_resource_list_change(sender, **kwargs):
+    invalidate_resource_list_cache()
+
+
+for model in RESOURCE_LIST_MODELS:
+    post_save.connect(handle_resource_list_change, sender=model,
+                      dispatch_uid='resource-list-save-%s' % model._meta.label_lower)
+    post_delete.connect(handle_resource_list_change, sender=model,
+                        dispatch_uid='resource-list-delete-%s' % model._meta.label_lower)
+for through in (Resource.purposes.through, ResourceGroup.resources.through):
+    m2m_changed.connect(handle_resource_list_change, sender=through,
+                        dispatch_uid='resource-list-m2m-%s' % through._meta.label_lower)
+
+
+@receiver(post_save, sender=Reservation, dispatch_uid='reservation-data-save')
+@receiver(post_delete, sender=Reservation, dispatch_uid='reservation-data-delete')
+def handle_reservation_data_change(sender, **kwargs):
+    invalidate_reservation_data()
+
+
+def handle_user_data_change(sender, **kwargs):
+    invalidate_user_data()
+
+
+@receiver(post_save, sender=get_user_model(), dispatch_uid='user-data-save-user')
+def handle_user_change(sender, update_fields=None, **kwargs):
+    # Logging in saves the user too
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_user_data()
+
+
+for model in USER_DATA_MODELS:
+    post_save.connect(handle_user_data_change, sender=model,
+                      dispatch_uid='user-data-save-%s' % model._meta.label_lower)
+    post_delete.connect(handle_user_data_change, sender=model,
+                        dispatch_uid='user-data-delete-%s' % model._meta.label_lower)
+for through in (get_user_model().groups.through, get_user_model().favorite_resources.through,
+                UnitGroup.members.through):
+    m2m_changed.connect(handle_user_data_change, sender=through,
+                        dispatch_uid='user-data-m2m-%s' % through._meta.label_lower)
+
+
+def handle_typeahead_change(sender, **kwargs):
+    invalidate_typeahead_cache()
+
+
+for model in (Resource, Unit):
+    post_save.connect(handle_typeahead_change, sender=model,
+                      dispatch_uid='typeahead-save-%s' % model._meta.label_lower)
+    post_delete.connect(handle_typeahead_change, sender=model,
+                        dispatch_uid='typeahead-delete-%s' % model._meta.label_lower)
+
+
+def handle_reservation_metadata_change(sender, **kwargs):
+    invalidate_lookup(RESERVATION_METADATA_SETS)
+
+
+def handle_accessibility_viewpoint_change(sender, **kwargs):
+    invalidate_lookup(ACCESSIBILITY_VIEWPOINTS)
+
+
+def handle_period_schedule_change(sender, **kwargs):
+    if is_period_schedule_cache_enabled():
+        invalidate_lookup(PERIOD_SCHEDULES)
+
+
+for model in (ReservationMetadataSet, ReservationMetadataField):
+    post_save.connect(handle_reservation_metadata_change, sender=model,
+                      dispatch_uid='lookup-save-%s' % model._meta.label_lower)
+    post_delete.connect(handle_reservation_metadata_change, sender=model,
+                        dispatch_uid='lookup-delete-%s' % model._meta.label_lower)
+for through in (ReservationMetadataSet.supported_fields.through, ReservationMetadataSet.required_fields.through):
+    m2m_changed.connect(handle_reservation_metadata_change, sender=through,
+                        dispatch_uid='lookup-m2m-%s' % through._meta.label_lower)
+post_save.connect(handle_accessibility_viewpoint_change, sender=AccessibilityViewpoint,
+                  dispatch_uid='lookup-save-accessibility-viewpoint')
+post_delete.connect(handle_accessibility_viewpoint_change, sender=AccessibilityViewpoint,
+                    dispatch_uid='lookup-delete-accessibility-viewpoint')
+for model in (Period, Day):
+    post_save.connect(handle_period_schedule_change, sender=model,
+                      dispatch_uid='lookup-save-%s' % model._meta.label_lower)
+    post_delete.connect(handle_period_schedule_change, sender=model,
+                        dispatch_uid='lookup-delete-%s' % model._meta.label_lower)
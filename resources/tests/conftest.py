@@ -8,9 +8,16 @@ from rest_framework.test import APIClient, APIRequestFactory
 from resources.models import Resource, ResourceType, Unit, Purpose, Day, Period
 from resources.models import Equipment, EquipmentAlias, ResourceEquipment, EquipmentCategory, TermsOfUse, ResourceGroup
 from resources.models import AccessibilityValue, AccessibilityViewpoint, ResourceAccessibility, UnitAccessibility
+from resources.models.lookup_cache import clear_lookup_cache
 from munigeo.models import Municipality
 
 
+@pytest.fixture(autouse=True)
+def clear_lookups():
+    # Lookup tables cached in memory by an earlier test may have been rolled back
+    clear_lookup_cache()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
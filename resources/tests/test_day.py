@@ -1,8 +1,9 @@
 import datetime
 from datetime import date
 import pytest
+from django.test.utils import override_settings
 
-from resources.models import Period, Day
+from resources.models import Period, Day, Resource, get_opening_hours
 from .utils import assert_hours
 
 
@@ -95,3 +96,143 @@ def test_opening_hours(resource_in_unit):
     assert_hours(tz, hours, date(2015, 1, 1), '10:00', '14:00')
     assert_hours(tz, hours, date(2015, 1, 2), '10:00', '14:00')
     assert_hours(tz, hours, date(2015, 1, 3), None)
+
+
+@pytest.mark.django_db
+def test_opening_hours_update_window(resource_in_unit):
+    unit = resource_in_unit.unit
+    tz = unit.get_tz()
+
+    p1 = Period.objects.create(start=date(2015, 1, 1), end=date(2015, 12, 31),
+                               unit=unit, name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=p1, weekday=weekday,
+                           opens=datetime.time(8, 0),
+                           closes=datetime.time(18, 0))
+    resource_in_unit.update_opening_hours()
+    assert resource_in_unit.opening_hours.count() == 365
+
+    p2 = Period.objects.create(start=date(2015, 6, 1), end=date(2015, 6, 30),
+                               resource=resource_in_unit, name='summer hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=p2, weekday=weekday,
+                           opens=datetime.time(10, 0),
+                           closes=datetime.time(16, 0))
+    Day.objects.filter(period=p1, weekday=0).delete()
+
+    # Only the dates within the window get recomputed
+    resource_in_unit.update_opening_hours(date(2015, 6, 8), date(2015, 6, 14))
+    begin = tz.localize(datetime.datetime(2015, 6, 1))
+    end = begin + datetime.timedelta(days=20)
+    hours = resource_in_unit.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 6, 1), '08:00', '18:00')
+    assert_hours(tz, hours, date(2015, 6, 7), '08:00', '18:00')
+    assert_hours(tz, hours, date(2015, 6, 8), '10:00', '16:00')
+    assert_hours(tz, hours, date(2015, 6, 14), '10:00', '16:00')
+    assert_hours(tz, hours, date(2015, 6, 15), '08:00', '18:00')
+
+    begin = tz.localize(datetime.datetime(2015, 10, 1))
+    end = begin + datetime.timedelta(days=10)
+    hours = resource_in_unit.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 10, 5), '08:00', '18:00')
+
+    resource_in_unit.update_opening_hours()
+    hours = resource_in_unit.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 10, 5), None)
+    assert resource_in_unit.opening_hours.count() == 365 - 52
+
+
+@pytest.mark.django_db
+def test_unit_opening_hours_with_resource_periods(resource_in_unit):
+    unit = resource_in_unit.unit
+    tz = unit.get_tz()
+    other_resource = Resource.objects.create(type=resource_in_unit.type, unit=unit, name='other resource',
+                                             authentication='none')
+
+    p1 = Period.objects.create(start=date(2015, 6, 1), end=date(2015, 6, 30),
+                               unit=unit, name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=p1, weekday=weekday,
+                           opens=datetime.time(8, 0),
+                           closes=datetime.time(18, 0))
+    p2 = Period.objects.create(start=date(2015, 6, 8), end=date(2015, 6, 14),
+                               resource=other_resource, name='closed mornings')
+    for weekday in range(0, 5):
+        Day.objects.create(period=p2, weekday=weekday,
+                           opens=datetime.time(12, 0),
+                           closes=datetime.time(18, 0))
+
+    unit.update_opening_hours()
+    assert resource_in_unit.opening_hours.count() == 30
+    assert other_resource.opening_hours.count() == 28
+
+    begin = tz.localize(datetime.datetime(2015, 6, 1))
+    end = begin + datetime.timedelta(days=20)
+    hours = resource_in_unit.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 6, 8), '08:00', '18:00')
+    hours = other_resource.get_opening_hours(begin, end)
+    assert_hours(tz, hours, date(2015, 6, 7), '08:00', '18:00')
+    assert_hours(tz, hours, date(2015, 6, 8), '12:00', '18:00')
+    assert_hours(tz, hours, date(2015, 6, 13), None)
+    assert_hours(tz, hours, date(2015, 6, 15), '08:00', '18:00')
+
+    # Nothing changes when recomputed
+    ids = set(other_resource.opening_hours.values_list('id', flat=True))
+    unit.update_opening_hours()
+    assert set(other_resource.opening_hours.values_list('id', flat=True)) == ids
+
+
+@pytest.mark.django_db
+@override_settings(RESPA_PERIOD_SCHEDULE_CACHE_ENABLED=True)
+def test_compiled_periods_are_reused(resource_in_unit, django_assert_num_queries):
+    unit = resource_in_unit.unit
+    tz = unit.get_tz()
+    p1 = Period.objects.create(start=date(2015, 1, 1), end=date(2016, 12, 31),
+                               unit=unit, name='regular hours')
+    for weekday in range(0, 5):
+        Day.objects.create(period=p1, weekday=weekday,
+                           opens=datetime.time(8, 0),
+                           closes=datetime.time(18, 0))
+
+    periods = list(unit.periods.all())
+    with django_assert_num_queries(1):
+        hours = get_opening_hours(unit.time_zone, periods, date(2015, 1, 1), date(2016, 12, 31))
+    with django_assert_num_queries(0):
+        assert get_opening_hours(unit.time_zone, periods, date(2015, 1, 1), date(2016, 12, 31)) == hours
+    assert len(hours) == 731
+    assert_hours(tz, hours, date(2016, 2, 29), '08:00', '18:00')
+    assert_hours(tz, hours, date(2016, 3, 5), None)
+
+    # Fetching the periods again reuses their compiled schedules
+    refetched_periods = list(unit.periods.all())
+    with django_assert_num_queries(0):
+        assert get_opening_hours(unit.time_zone, refetched_periods, date(2015, 1, 1), date(2016, 12, 31)) == hours
+
+    # Changing the days of the period makes it get compiled again
+    Day.objects.filter(period=p1, weekday=0).get().delete()
+    with django_assert_num_queries(1):
+        hours = get_opening_hours(unit.time_zone, periods, date(2015, 1, 1), date(2016, 12, 31))
+    assert_hours(tz, hours, date(2016, 2, 29), None)
+    assert_hours(tz, hours, date(2016, 3, 1), '08:00', '18:00')
+
+    # and so does changing the dates of the period
+    periods[0].end = date(2015, 12, 31)
+    with django_assert_num_queries(1):
+        hours = get_opening_hours(unit.time_zone, periods, date(2015, 1, 1), date(2016, 12, 31))
+    assert_hours(tz, hours, date(2016, 3, 1), None)
+
+
+@pytest.mark.django_db
+@override_settings(RESPA_PERIOD_SCHEDULE_CACHE_ENABLED=True)
+def test_opening_hours_update_compiles_periods_afresh(resource_in_unit):
+    unit = resource_in_unit.unit
+    tz = unit.get_tz()
+    p1 = Period.objects.create(start=date(2115, 1, 1), end=date(2115, 12, 31), unit=unit, name='regular hours')
+    Day.objects.create(period=p1, weekday=0, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
+    assert_hours(tz, get_opening_hours(unit.time_zone, [p1], date(2115, 1, 7)), date(2115, 1, 7), '08:00', '18:00')
+
+    # A change another process made, as far as this process can tell
+    Day.objects.filter(period=p1).update(opens=datetime.time(10, 0))
+    resource_in_unit.update_opening_hours()
+    hours = resource_in_unit.get_opening_hours(date(2115, 1, 7), date(2115, 1, 7))
+    assert_hours(tz, hours, date(2115, 1, 7), '10:00', '18:00')
@@ -0,0 +1,40 @@
+import datetime
+
+import pytest
+from django.test.utils import override_settings
+
+from resources.models import Reservation
+from resources.models.occupancy import get_occupancy
+
+
+def get_dt(tz, hour, minute=0):
+    return tz.localize(datetime.datetime(2115, 4, 4, hour, minute))
+
+
+@pytest.mark.django_db
+@override_settings(RESPA_OCCUPANCY_BITMAPS_ENABLED=True)
+def test_occupancy_bitmaps_follow_reservations(resource_in_unit, user, django_assert_num_queries):
+    resource = resource_in_unit
+    resource.slot_size = datetime.timedelta(minutes=30)
+    resource.save()
+    tz = resource.unit.get_tz()
+    reservation = Reservation.objects.create(
+        resource=resource, begin=get_dt(tz, 10), end=get_dt(tz, 11), user=user
+    )
+
+    date = datetime.date(2115, 4, 4)
+    assert get_occupancy([resource], [date])[(resource.id, date)].reserved == 0b11 << 20
+
+    # The bitmaps are cached, so free time is found without queries
+    with django_assert_num_queries(0):
+        assert resource.check_reservation_collision(get_dt(tz, 11), get_dt(tz, 12), None) is False
+    assert resource.check_reservation_collision(get_dt(tz, 10, 30), get_dt(tz, 11, 30), None) is True
+    assert resource.check_reservation_collision(get_dt(tz, 10), get_dt(tz, 11), reservation) is False
+
+    Reservation.objects.create(resource=resource, begin=get_dt(tz, 12), end=get_dt(tz, 13), user=user)
+    assert resource.check_reservation_collision(get_dt(tz, 12, 30), get_dt(tz, 13), None) is True
+
+    # The bitmaps of the day are rebuilt with a single query
+    reservation.set_state(Reservation.CANCELLED, user)
+    with django_assert_num_queries(1):
+        assert resource.check_reservation_collision(get_dt(tz, 10), get_dt(tz, 11), None) is False
@@ -1,10 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import arrow
 import pytest
 from django.conf import settings
 
 from resources.models import Day, Period, Reservation, Resource, ResourceType, Unit
+from resources.models.utils import get_local_datetime, get_tz
 
 TEST_PERFORMANCE = bool(getattr(settings, "TEST_PERFORMANCE", False))
 
@@ -87,3 +88,74 @@ def test_avail_resource_scalability(client):
         response = client.get('/test/availability?start_date=2015-06-01&end_date=2015-06-30')
         end = datetime.now()
         perf_res_list.write(str(n) + ', ' + str(end - start) + '\n')
+
+
+@pytest.mark.skipif(not TEST_PERFORMANCE, reason="TEST_PERFORMANCE not enabled")
+@pytest.mark.django_db
+def test_timetools_availability_scalability():
+    from resources.timetools import get_availability
+
+    u1 = Unit.objects.create(name='Unit 1', id='unit_1', time_zone='Europe/Helsinki')
+    rt = ResourceType.objects.create(name='Type 1', id='type_1', main_type='space')
+    p1 = Period.objects.create(start='2015-01-01', end='2015-12-31', unit=u1, name='')
+    for weekday in range(0, 7):
+        Day.objects.create(period=p1, weekday=weekday, opens='08:00', closes='20:00')
+    tz = u1.get_tz()
+    first_day = arrow.get('2015-06-01').date()
+
+    perf_availability = open('perf_timetools_availability.csv', 'w')
+    perf_availability.write('Availability engine\n')
+    perf_availability.write('resources, days, reservations per day, time (s)\n')
+    for n in [1, 10, 100]:
+        Resource.objects.all().delete()
+        for i in range(n):
+            Resource.objects.create(name=('Resource ' + str(i)), id=('r' + str(i)), unit=u1, type=rt)
+        u1.update_opening_hours()
+
+        for reservations_per_day in [0, 1, 4]:
+            Reservation.objects.all().delete()
+            reservations = []
+            for resource in Resource.objects.all():
+                for day in range(31):
+                    for hour in range(reservations_per_day):
+                        begin = tz.localize(datetime.combine(first_day, datetime.min.time())).replace(
+                            hour=9 + 2 * hour) + timedelta(days=day)
+                        end = begin + timedelta(hours=1)
+                        reservations.append(Reservation(resource=resource, begin=begin, end=end,
+                                                        duration=(begin, end, '[)')))
+            Reservation.objects.bulk_create(reservations)
+
+            for days in [1, 7, 31]:
+                start = datetime.now()
+                get_availability(first_day, first_day + timedelta(days=days - 1),
+                                 duration=timedelta(hours=1))
+                end = datetime.now()
+                perf_availability.write('%d, %d, %d, %s\n' % (n, days, reservations_per_day, end - start))
+
+
+@pytest.mark.skipif(not TEST_PERFORMANCE, reason="TEST_PERFORMANCE not enabled")
+@pytest.mark.django_db
+def test_resource_opening_hours_serialization_time(api_client):
+    u1 = Unit.objects.create(name='Unit 1', id='unit_1', time_zone='Europe/Helsinki')
+    rt = ResourceType.objects.create(name='Type 1', id='type_1', main_type='space')
+    p1 = Period.objects.create(start='2115-01-01', end='2115-12-31', unit=u1, name='')
+    for weekday in range(7):
+        Day.objects.create(period=p1, weekday=weekday, opens='08:00', closes='16:00')
+    for i in range(100):
+        Resource.objects.create(name='Resource %d' % i, id='r%d' % i, unit=u1, type=rt)
+    u1.update_opening_hours()
+
+    perf_tz = open('perf_tz.csv', 'w')
+    perf_tz.write('Resource listing with a month of opening hours\n')
+    perf_tz.write('time helper caches, time per resource (s)\n')
+    url = '/v1/resource/?start=2115-06-01T00:00:00%2B03:00&end=2115-06-30T23:59:59%2B03:00&page_size=100'
+    for label, clear_caches in (('cold', True), ('warm', False)):
+        if clear_caches:
+            get_tz.cache_clear()
+            get_local_datetime.cache_clear()
+        start = datetime.now()
+        response = api_client.get(url)
+        end = datetime.now()
+        assert response.status_code == 200
+        perf_tz.write('%s, %s\n' % (label, (end - start) / 100))
+    perf_tz.close()
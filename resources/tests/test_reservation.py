@@ -3,12 +3,16 @@ import pytest
 
 import arrow
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.utils.translation import activate
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from freezegun import freeze_time
 
+from resources.enums import UnitAuthorizationLevel
 from resources.models import *
+from resources.models.resource import load_reservation_validation_data
 
 
 class ReservationTestCase(TestCase):
@@ -139,3 +143,48 @@ def test_invalid_reservation_duration_with_slot_size(resource_with_opening_hours
     with pytest.raises(ValidationError) as error:
         reservation.clean()
     assert error.value.code == 'invalid_time_slot'
+
+
+@freeze_time('2115-04-02')
+@pytest.mark.django_db
+def test_validators_share_memoized_opening_hours(resource_with_opening_hours, user):
+    resource = Resource.objects.get(pk=resource_with_opening_hours.pk)
+    resource.memoize_opening_hours()
+    tz = resource.get_tz()
+    begin = tz.localize(datetime.datetime(2115, 6, 1, 10, 0, 0))
+    end = begin + datetime.timedelta(hours=1)
+
+    with CaptureQueriesContext(connection) as context:
+        resource.validate_reservation_period(None, user, data={'begin': begin, 'end': end})
+        Reservation(resource=resource, begin=begin, end=end).clean()
+    hours_queries = [query for query in context.captured_queries
+                     if 'resources_resourcedailyopeninghours' in query['sql']]
+    assert len(hours_queries) == 1
+
+    # Updating the opening hours makes the memo forget the old ones
+    resource.periods.get().days.filter(weekday=begin.weekday()).update(opens=datetime.time(12, 0))
+    resource.update_opening_hours()
+    with pytest.raises(ValidationError):
+        resource.validate_reservation_period(None, user, data={'begin': begin, 'end': end})
+
+
+@freeze_time('2115-04-02')
+@pytest.mark.django_db
+def test_resource_for_reservation_validation(resource_with_opening_hours, user, django_assert_num_queries):
+    resource = resource_with_opening_hours
+    UnitAuthorization.objects.create(subject=resource.unit, level=UnitAuthorizationLevel.manager, authorized=user)
+    tz = resource.unit.get_tz()
+    begin = tz.localize(datetime.datetime(2115, 6, 1, 10, 0, 0))
+    end = begin + datetime.timedelta(hours=1)
+    Reservation.objects.create(resource=resource, begin=end - datetime.timedelta(minutes=30),
+                               end=end + datetime.timedelta(minutes=30), user=user, state=Reservation.CONFIRMED)
+
+    fetched = Resource.objects.select_related('unit').get(pk=resource.pk)
+    with django_assert_num_queries(1):
+        load_reservation_validation_data(fetched, user, begin, end)
+    with django_assert_num_queries(0):
+        assert fetched.is_admin(user) is False
+        assert fetched.is_manager(user) is True
+        assert fetched.check_reservation_collision(begin, end, None) is True
+        opening_hours = fetched.get_opening_hours(begin.date(), end.date())
+    assert opening_hours == Resource.objects.get(pk=resource.pk).get_opening_hours(begin.date(), end.date())
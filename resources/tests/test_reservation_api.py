@@ -1,9 +1,11 @@
 import pytest
 import datetime
+import json
 import re
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.core import mail
+from django.core.cache import cache
 from django.test.utils import override_settings
 from django.utils import dateparse, timezone, translation
 from guardian.shortcuts import assign_perm, remove_perm
@@ -18,6 +20,7 @@ from resources.models import (Period, Day, Reservation, Resource, ResourceGroup,
                               ReservationMetadataSet, UnitAuthorization)
 from notifications.models import NotificationTemplate, NotificationType
 from notifications.tests.utils import check_received_mail_exists
+from resources.api.reservation import iter_reservation_export_rows
 from .utils import check_disallowed_methods, assert_non_field_errors_contain, assert_response_objects
 
 
@@ -119,11 +122,11 @@ def reservation2(resource_in_unit2, user):
 
 @pytest.fixture
 def reservation3(resource_in_unit2, user2):
-    # the same as reservation2 but different user
+    # right after reservation2 but for a different user
     return Reservation.objects.create(
         resource=resource_in_unit2,
-        begin='2115-04-05T09:00:00+02:00',
-        end='2115-04-05T10:00:00+02:00',
+        begin='2115-04-05T10:00:00+02:00',
+        end='2115-04-05T11:00:00+02:00',
         user=user2,
         event_subject='not so fancy event',
         host_name='markku',
@@ -708,7 +711,14 @@ def test_reservation_excels(staff_api_client, list_url, detail_url, reservation,
     )
     assert response.status_code == 200
     assert response._headers['content-disposition'] == ('Content-Disposition', 'attachment; filename=reservations.xlsx')
-    assert len(response.content) > 0
+    assert len(b''.join(response.streaming_content)) > 0
+
+    # the list export is paginated
+    response = staff_api_client.get(
+        list_url, {'page': 'x'},
+        HTTP_ACCEPT='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+    assert response.status_code == 404
 
     response = staff_api_client.get(
         detail_url,
@@ -1960,3 +1970,115 @@ def test_resource_filter(resource_in_unit, resource_in_unit2, other_resource, re
     response = api_client.get(list_url + '?resource={},{}'.format(resource_in_unit.id, resource_in_unit2.id))
     assert response.status_code == 200
     assert_response_objects(response, (reservation, reservation2))
+
+
+@pytest.mark.django_db
+def test_overlapping_reservation_refused_by_database(resource_in_unit, list_url, reservation_data, user,
+                                                     user_api_client, monkeypatch):
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-04T11:30:00+02:00',
+        end='2115-04-04T12:30:00+02:00',
+        user=user,
+        state=Reservation.CONFIRMED,
+    )
+    # Let the validation miss the collision like a concurrent request would
+    monkeypatch.setattr(Resource, 'check_reservation_collision', lambda *args: False)
+
+    response = user_api_client.post(list_url, data=reservation_data)
+    assert response.status_code == 400
+    assert_non_field_errors_contain(response, 'The resource is already reserved for some of the period')
+    assert Reservation.objects.filter(resource=resource_in_unit).count() == 1
+
+
+@pytest.mark.django_db
+@override_settings(RESPA_CONDITIONAL_GET_ENABLED=True)
+def test_reservation_list_conditional_get(user_api_client, list_url, reservation):
+    cache.clear()
+    response = user_api_client.get(list_url)
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    response = user_api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    reservation.end += datetime.timedelta(hours=1)
+    reservation.save()
+    response = user_api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+@pytest.mark.django_db
+def test_reservation_sparse_fieldsets(user_api_client, list_url, reservation):
+    response = user_api_client.get(list_url, {'fields': 'id,begin,end'})
+    assert response.status_code == 200
+    assert set(response.data['results'][0]) == {'id', 'begin', 'end'}
+
+    response = user_api_client.get(list_url, {'omit': 'user_permissions'})
+    assert response.status_code == 200
+    assert 'user_permissions' not in response.data['results'][0]
+    assert 'is_own' in response.data['results'][0]
+
+
+@pytest.mark.django_db
+def test_reservation_keyset_pagination(user_api_client, list_url, reservation, reservation2, reservation3,
+                                       resource_in_unit2, user):
+    # begins at the same time as reservation, so the order is decided by the id
+    same_begin = Reservation.objects.create(
+        resource=resource_in_unit2,
+        begin=reservation.begin,
+        end=reservation.end,
+        user=user,
+        state=Reservation.CONFIRMED
+    )
+
+    ids = []
+    response = user_api_client.get(list_url, {'pagination': 'cursor', 'page_size': 1})
+    while True:
+        assert response.status_code == 200
+        assert 'count' not in response.data
+        ids.extend(result['id'] for result in response.data['results'])
+        if not response.data['next']:
+            break
+        response = user_api_client.get(response.data['next'])
+    assert ids == [reservation.id, same_begin.id, reservation2.id, reservation3.id]
+
+    response = user_api_client.get(list_url, {'cursor': 'invalid'})
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_reservation_export_rows(resource_in_unit, user, user2, general_admin, reservation, reservation3):
+    queryset = Reservation.objects.order_by('begin')
+
+    rows = list(iter_reservation_export_rows(queryset, general_admin))
+    assert [row['id'] for row in rows] == [reservation.id, reservation3.id]
+    assert rows[0]['user'] == user.email
+    assert rows[0]['resource'] == resource_in_unit.name
+
+    # Other users' reservations are exported without the user and comments
+    rows = list(iter_reservation_export_rows(queryset, user2))
+    assert 'user' not in rows[0]
+    assert 'comments' not in rows[0]
+
+
+@pytest.mark.django_db
+def test_reservation_streaming_exports(user_api_client, list_url, detail_url, reservation, reservation2):
+    response = user_api_client.get(list_url, {'format': 'csv'})
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/csv')
+    lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+    assert lines[0].startswith('id,unit,resource,begin,end')
+    assert [line.split(',')[0] for line in lines[1:]] == [str(reservation.id), str(reservation2.id)]
+
+    response = user_api_client.get(list_url, {'format': 'ndjson'})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+    assert [row['id'] for row in rows] == [reservation.id, reservation2.id]
+    assert rows[0]['resource'] == reservation.resource.name
+
+    response = user_api_client.get(detail_url, {'format': 'ndjson'})
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+    assert [row['id'] for row in rows] == [reservation.id]
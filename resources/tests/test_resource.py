@@ -4,11 +4,13 @@ import pytest
 import datetime
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.translation import activate
 from PIL import Image
 
 from resources.errors import InvalidImage
-from resources.models import ResourceImage
+from resources.models import ReservationMetadataField, ReservationMetadataSet, Resource, ResourceImage
 from resources.tests.utils import create_resource_image, get_test_image_data, get_field_errors
 
 
@@ -117,3 +119,37 @@ def test_time_slot_validations(resource_in_unit):
     resource_in_unit.min_period = datetime.timedelta(hours=2)
     resource_in_unit.slot_size = datetime.timedelta(minutes=30)
     resource_in_unit.full_clean()
+
+
+@pytest.mark.django_db
+def test_reservation_metadata_sets_cached_in_memory(resource_in_unit, django_assert_num_queries):
+    name_field = ReservationMetadataField.objects.get_or_create(field_name='reserver_name')[0]
+    phone_field = ReservationMetadataField.objects.get_or_create(field_name='reserver_phone_number')[0]
+    metadata_set = ReservationMetadataSet.objects.create(name='test set')
+    metadata_set.supported_fields.set([name_field])
+    resource_in_unit.reservation_metadata_set = metadata_set
+    resource_in_unit.save()
+
+    assert resource_in_unit.get_supported_reservation_extra_field_names() == ['reserver_name']
+    with django_assert_num_queries(0):
+        assert resource_in_unit.get_supported_reservation_extra_field_names() == ['reserver_name']
+        assert resource_in_unit.get_required_reservation_extra_field_names() == []
+
+    metadata_set.required_fields.add(phone_field)
+    assert resource_in_unit.get_required_reservation_extra_field_names() == ['reserver_phone_number']
+
+
+@pytest.mark.django_db
+def test_search_document_updated_only_when_text_changes(resource_in_unit):
+    def saving_updates_search_document(resource):
+        with CaptureQueriesContext(connection) as context:
+            resource.save()
+        return any('search_document' in query['sql'] for query in context.captured_queries)
+
+    resource = Resource.objects.get(pk=resource_in_unit.pk)
+    resource.max_reservations_per_user = 2
+    assert not saving_updates_search_document(resource)
+
+    resource.name_fi = 'Kokoushuone'
+    assert saving_updates_search_document(resource)
+    assert not saving_updates_search_document(resource)
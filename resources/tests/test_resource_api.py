@@ -1,15 +1,18 @@
 import datetime
 import pytest
 from copy import deepcopy
+from django.core.cache import cache
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.contrib.gis.geos import Point
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from freezegun import freeze_time
 from guardian.shortcuts import assign_perm, remove_perm
 from ..enums import UnitAuthorizationLevel, UnitGroupAuthorizationLevel
 
-from resources.models import (Day, Equipment, Period, Reservation, ReservationMetadataSet, ResourceEquipment,
-                              ResourceType, Unit, UnitAuthorization, UnitGroup)
+from resources.models import (Day, Equipment, Period, Reservation, ReservationMetadataSet, Resource,
+                              ResourceEquipment, ResourceType, Unit, UnitAuthorization, UnitGroup)
 from .utils import assert_response_objects, check_only_safe_methods_allowed, is_partial_dict_in_list
 
 
@@ -240,6 +243,25 @@ def test_api_resource_geo_queries(api_client, resource_in_unit):
     assert results[0]['id'].endswith('r4')
     assert results[0]['distance'] == 53907
 
+    # Resources located only by their unit are ordered nearest first as well
+    response = api_client.get(base_url + '?lat=61&lon=24.5')
+    results = response.data['results']
+    assert results[0]['id'].endswith('r4')
+    distances = [result['distance'] for result in results if 'distance' in result]
+    assert distances == sorted(distances)
+
+    # Moving the unit moves the resources without a location of their own
+    modified_at = Resource.objects.get(pk=id_base + "r4").modified_at
+    unit.location = Point(30, 65, srid=4326)
+    unit.save()
+    assert Resource.objects.get(pk=id_base + "r4").modified_at > modified_at
+    response = api_client.get(url)
+    assert response.data['count'] == 0
+    response = api_client.get(base_url + '?lat=65&lon=30&distance=1000')
+    assert response.data['count'] == 1
+    assert response.data['results'][0]['id'].endswith('r4')
+    assert response.data['results'][0]['distance'] == 0
+
 
 @pytest.mark.django_db
 def test_resource_favorite(staff_api_client, staff_user, resource_in_unit):
@@ -313,6 +335,17 @@ def test_is_favorite_field(api_client, staff_api_client, staff_user, resource_in
     assert response.data['is_favorite'] is True
 
 
+@pytest.mark.django_db
+def test_is_favorite_field_in_list(list_url, staff_api_client, staff_user, user, resource_in_unit, resource_in_unit2):
+    staff_user.favorite_resources.add(resource_in_unit)
+    user.favorite_resources.add(resource_in_unit2)
+
+    response = staff_api_client.get(list_url)
+    assert response.status_code == 200
+    is_favorite = {resource['id']: resource['is_favorite'] for resource in response.data['results']}
+    assert is_favorite == {resource_in_unit.id: True, resource_in_unit2.id: False}
+
+
 @pytest.mark.django_db
 def test_filtering_by_is_favorite(list_url, api_client, staff_api_client, staff_user, resource_in_unit,
                                   resource_in_unit2):
@@ -727,6 +760,94 @@ def test_available_between_with_period(list_url, resource_in_unit, resource_in_u
     assert_response_objects(response, expected_resources)
 
 
+@pytest.mark.parametrize('period, expected', (
+    (60, [0]),
+    (120, [0]),
+    (121, []),
+))
+@pytest.mark.django_db
+def test_available_between_with_period_adjacent_reservations(list_url, resource_in_unit, user, user_api_client,
+                                                             period, expected):
+    p1 = Period.objects.create(start=datetime.date(2115, 4, 1),
+                               end=datetime.date(2115, 4, 8),
+                               resource=resource_in_unit)
+    for weekday in range(0, 7):
+        Day.objects.create(period=p1, weekday=weekday,
+                           opens=datetime.time(8, 0),
+                           closes=datetime.time(16, 00))
+    resource_in_unit.update_opening_hours()
+
+    for begin, end, state in (('08:30', '10:00', Reservation.CONFIRMED), ('10:00', '11:00', Reservation.CONFIRMED),
+                              ('11:00', '13:00', Reservation.CONFIRMED), ('13:00', '14:00', Reservation.CANCELLED),
+                              ('15:00', '17:00', Reservation.CONFIRMED)):
+        Reservation.objects.create(
+            resource=resource_in_unit,
+            begin='2115-04-08T{}:00+02:00'.format(begin),
+            end='2115-04-08T{}:00+02:00'.format(end),
+            user=user,
+            state=state,
+        )
+
+    params = {'available_between': '2115-04-08T07:00:00+02:00,2115-04-08T18:00:00+02:00,{}'.format(period)}
+    response = user_api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert_response_objects(response, [resource_in_unit] if expected else [])
+
+
+def _hours(data):
+    return [(hours['starts'], hours['ends']) for hours in data]
+
+
+def _dt(value):
+    return parse_datetime('2115-04-08T%s+02:00' % value)
+
+
+# The first resource has a reservation from 10 to 11 and the second one a cancelled reservation at the same time
+@pytest.mark.parametrize('params, expected, expected2', (
+    ({}, [('08:00', '10:00'), ('11:00', '16:00')], [('08:00', '16:00')]),
+    ({'duration': 120}, [('08:00', '10:00'), ('11:00', '16:00')], [('08:00', '16:00')]),
+    ({'duration': 180}, [('11:00', '16:00')], [('08:00', '16:00')]),
+    ({'during_closing': 'true'}, [('00:00', '10:00'), ('11:00', '23:00')], [('00:00', '23:00')]),
+))
+@pytest.mark.django_db
+def test_available_hours_in_resource_list(list_url, api_client, resource_in_unit, resource_in_unit2, user,
+                                          params, expected, expected2):
+    for resource in (resource_in_unit, resource_in_unit2):
+        p1 = Period.objects.create(start=datetime.date(2115, 4, 1),
+                                   end=datetime.date(2115, 4, 30),
+                                   resource=resource)
+        for weekday in range(0, 7):
+            Day.objects.create(period=p1, weekday=weekday,
+                               opens=datetime.time(8, 0),
+                               closes=datetime.time(16, 0))
+        resource.update_opening_hours()
+
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-08T10:00:00+02:00',
+        end='2115-04-08T11:00:00+02:00',
+        user=user,
+    )
+    cancelled = Reservation.objects.create(
+        resource=resource_in_unit2,
+        begin='2115-04-08T10:00:00+02:00',
+        end='2115-04-08T11:00:00+02:00',
+        user=user,
+    )
+    cancelled.set_state(Reservation.CANCELLED, user)
+
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert all(resource['available_hours'] is None for resource in response.data['results'])
+
+    params = dict(params, start='2115-04-08T00:00:00+02:00', end='2115-04-08T23:00:00+02:00')
+    response = api_client.get(list_url, params)
+    assert response.status_code == 200
+    available_hours = {resource['id']: resource['available_hours'] for resource in response.data['results']}
+    assert _hours(available_hours[resource_in_unit.id]) == [(_dt(begin), _dt(end)) for begin, end in expected]
+    assert _hours(available_hours[resource_in_unit2.id]) == [(_dt(begin), _dt(end)) for begin, end in expected2]
+
+
 @pytest.mark.django_db
 def test_filtering_free_of_charge(list_url, api_client, resource_in_unit,
                                   resource_in_unit2, resource_in_unit3):
@@ -1012,3 +1133,213 @@ def test_resource_with_accessibility_data(api_client, resource_with_accessibilit
         assert is_partial_dict_in_list(
             {'value': acc.value.value, 'viewpoint_id': acc.viewpoint_id},
             response.data['accessibility_summaries'])
+
+
+@pytest.mark.django_db
+def test_available_slots(api_client, resource_in_unit, resource_in_unit2, user):
+    url = reverse('resource-available-slots')
+    for resource, opens, closes in ((resource_in_unit, 8, 16), (resource_in_unit2, 12, 14)):
+        p1 = Period.objects.create(start=datetime.date(2115, 4, 1),
+                                   end=datetime.date(2115, 4, 30),
+                                   resource=resource)
+        for weekday in range(0, 7):
+            Day.objects.create(period=p1, weekday=weekday,
+                               opens=datetime.time(opens, 0),
+                               closes=datetime.time(closes, 0))
+        resource.update_opening_hours()
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-08T08:00:00+02:00',
+        end='2115-04-08T11:00:00+02:00',
+        user=user,
+    )
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-08T13:00:00+02:00',
+        end='2115-04-08T14:00:00+02:00',
+        user=user,
+    )
+
+    response = api_client.get(url, {'duration': 120, 'start': '2115-04-08T00:00:00+02:00', 'limit': 3})
+    assert response.status_code == 200
+    assert [(slot['resource'], slot['starts'], slot['ends']) for slot in response.data] == [
+        (resource_in_unit.id, _dt('11:00'), _dt('13:00')),
+        (resource_in_unit2.id, _dt('12:00'), _dt('14:00')),
+        (resource_in_unit.id, _dt('14:00'), _dt('16:00')),
+    ]
+
+    response = api_client.get(url, {'duration': 120, 'start': '2115-04-08T00:00:00+02:00', 'limit': 3,
+                                     'unit': resource_in_unit.unit_id})
+    assert response.status_code == 200
+    assert [(slot['resource'], slot['starts']) for slot in response.data] == [
+        (resource_in_unit.id, _dt('11:00')),
+        (resource_in_unit.id, _dt('14:00')),
+        (resource_in_unit.id, parse_datetime('2115-04-09T08:00:00+02:00')),
+    ]
+
+    # Outside the opening hours the last free period lasts until the end of the horizon, and
+    # yields one slot even though it is found again in each search window
+    response = api_client.get(url, {'duration': 120, 'start': '2115-04-08T00:00:00+02:00', 'limit': 4,
+                                     'horizon': 5, 'during_closing': 'true', 'unit': resource_in_unit.unit_id})
+    assert response.status_code == 200
+    assert [(slot['resource'], slot['starts']) for slot in response.data] == [
+        (resource_in_unit.id, _dt('00:00')),
+        (resource_in_unit.id, _dt('11:00')),
+        (resource_in_unit.id, _dt('14:00')),
+    ]
+
+    # nothing is free for that long
+    response = api_client.get(url, {'duration': 600, 'start': '2115-04-08T00:00:00+02:00', 'horizon': 30})
+    assert response.status_code == 200
+    assert response.data == []
+
+    response = api_client.get(url)
+    assert response.status_code == 400
+    response = api_client.get(url, {'duration': 120, 'horizon': 1000})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+@override_settings(RESPA_RESOURCE_LIST_CACHE_ENABLED=True)
+def test_resource_list_cache(api_client, user_api_client, list_url, resource_in_unit):
+    cache.clear()
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert response.data['results'][0]['name']['fi'] == resource_in_unit.name_fi
+
+    # A change that sends no signals is not seen by anonymous users, but is seen by authenticated ones
+    Resource.objects.filter(pk=resource_in_unit.pk).update(name_fi='muutettu')
+    response = api_client.get(list_url)
+    assert response.data['results'][0]['name']['fi'] == resource_in_unit.name_fi
+    response = user_api_client.get(list_url)
+    assert response.data['results'][0]['name']['fi'] == 'muutettu'
+
+    # Other query parameters are cached separately
+    response = api_client.get(list_url, {'page_size': 10})
+    assert response.data['results'][0]['name']['fi'] == 'muutettu'
+
+    resource_in_unit.name_fi = 'muutettu taas'
+    resource_in_unit.save()
+    response = api_client.get(list_url)
+    assert response.data['results'][0]['name']['fi'] == 'muutettu taas'
+
+    # Listings depending on reservations are not cached
+    Resource.objects.filter(pk=resource_in_unit.pk).update(name_fi='muutettu kolmesti')
+    params = {'start': '2115-04-04T00:00:00+02:00', 'end': '2115-04-05T00:00:00+02:00'}
+    response = api_client.get(list_url, params)
+    assert response.data['results'][0]['name']['fi'] == 'muutettu kolmesti'
+    Resource.objects.filter(pk=resource_in_unit.pk).update(name_fi='muutettu neljästi')
+    response = api_client.get(list_url, params)
+    assert response.data['results'][0]['name']['fi'] == 'muutettu neljästi'
+
+
+@pytest.mark.django_db
+def test_resource_detail_conditional_get(api_client, detail_url, resource_in_unit, user, settings):
+    url = detail_url
+    response = api_client.get(url)
+    assert 'ETag' not in response
+
+    settings.RESPA_CONDITIONAL_GET_ENABLED = True
+    cache.clear()
+    response = api_client.get(url)
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert response['Last-Modified']
+
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    Reservation.objects.create(
+        resource=resource_in_unit,
+        begin='2115-04-04T09:00:00+02:00',
+        end='2115-04-04T10:00:00+02:00',
+        user=user,
+    )
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    # Units do not update their modification time, but their changes are noticed
+    etag = response['ETag']
+    resource_in_unit.unit.name_fi = 'muutettu'
+    resource_in_unit.unit.save()
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    # and so are the changes in what the user may do
+    api_client.force_authenticate(user=user)
+    response = api_client.get(url)
+    etag = response['ETag']
+    assign_perm('unit:can_make_reservations', user, resource_in_unit.unit)
+    response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+@pytest.mark.django_db
+def test_opening_hours_in_list_with_several_time_zones(api_client, list_url, resource_in_unit, resource_in_unit2):
+    resource_in_unit2.unit.time_zone = 'America/New_York'
+    resource_in_unit2.unit.save()
+    for resource in (resource_in_unit, resource_in_unit2):
+        period = Period.objects.create(start=datetime.date(2115, 4, 1),
+                                       end=datetime.date(2115, 4, 30),
+                                       resource=resource)
+        for weekday in range(0, 7):
+            Day.objects.create(period=period, weekday=weekday,
+                               opens=datetime.time(8, 0),
+                               closes=datetime.time(16, 0))
+        resource.update_opening_hours()
+
+    params = {'start': '2115-04-08T00:00:00+02:00', 'end': '2115-04-09T00:00:00+02:00'}
+    response = api_client.get(list_url, params)
+    assert response.status_code == 200
+    results = {result['id']: result for result in response.data['results']}
+    assert len(results) == 2
+
+    for resource in (resource_in_unit, resource_in_unit2):
+        opening_hours = results[resource.id]['opening_hours']
+        assert any(day['opens'] for day in opening_hours)
+        response = api_client.get(get_detail_url(resource), params)
+        assert response.data['opening_hours'] == opening_hours
+
+
+@pytest.mark.django_db
+def test_resource_sparse_fieldsets(api_client, list_url, detail_url, resource_in_unit):
+    response = api_client.get(list_url, {'fields': 'id,name'})
+    assert response.status_code == 200
+    assert set(response.data['results'][0]) == {'id', 'name'}
+
+    response = api_client.get(detail_url, {'omit': 'opening_hours,reservations'})
+    assert response.status_code == 200
+    assert 'opening_hours' not in response.data
+    assert 'reservations' not in response.data
+    assert response.data['id'] == resource_in_unit.id
+
+    # Extra fields requested with include are shown regardless
+    response = api_client.get(list_url, {'fields': 'id', 'include': 'unit_detail'})
+    assert set(response.data['results'][0]) == {'id', 'unit'}
+    assert 'name' in response.data['results'][0]['unit']
+
+
+@pytest.mark.django_db
+def test_resource_full_text_search(api_client, list_url, resource_in_unit, resource_in_unit2, test_unit2):
+    resource_in_unit.name_fi = 'Kokoushuone Aalto'
+    resource_in_unit.description_en = 'Meeting room with a projector'
+    resource_in_unit.save()
+    resource_in_unit2.description_fi = 'Kokoushuoneen vieressä'
+    resource_in_unit2.save()
+
+    # Matches in names rank above matches in descriptions
+    response = api_client.get(list_url, {'search': 'kokous'})
+    assert response.status_code == 200
+    assert [result['id'] for result in response.data['results']] == [resource_in_unit.id, resource_in_unit2.id]
+
+    response = api_client.get(list_url, {'search': 'projector'})
+    assert_response_objects(response, resource_in_unit)
+
+    # Search documents follow the names of the units
+    test_unit2.name_fi = 'Kirjasto'
+    test_unit2.save()
+    response = api_client.get(list_url, {'search': 'kirjasto'})
+    assert_response_objects(response, resource_in_unit2)
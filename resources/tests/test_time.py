@@ -1,43 +1,129 @@
 import datetime
 
-from resources.models import *
-
-
-class TimeTestCase:
-
-    def setUp(self):
-        u1 = Unit.objects.create(name='Unit 1', id='unit_1')
-        rt = ResourceType.objects.create(name='Type 1', id='type_1', main_type='space')
-        Resource.objects.create(name='Resource 1a', id='r1a', unit=u1, type=rt)
-        Resource.objects.create(name='Resource 1b', id='r1b', unit=u1, type=rt)
-        Resource.objects.create(name='Resource 2a', id='r2a', unit=u1, type=rt)
-        Resource.objects.create(name='Resource 2b', id='r2b', unit=u1, type=rt)
-
-        # Regular hours for one week
-        p1 = Period.objects.create(start=datetime.date(2015, 8, 3), end=datetime.date(2015, 8, 9),
-                                   unit=u1, name='regular hours')
-        Day.objects.create(period=p1, weekday=0, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-        Day.objects.create(period=p1, weekday=1, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-        Day.objects.create(period=p1, weekday=2, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-        Day.objects.create(period=p1, weekday=3, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-        Day.objects.create(period=p1, weekday=4, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
-        Day.objects.create(period=p1, weekday=5, opens=datetime.time(12, 0), closes=datetime.time(16, 0))
-        Day.objects.create(period=p1, weekday=6, opens=datetime.time(12, 0), closes=datetime.time(14, 0))
-
-        # Two shorter days as exception
-        exp1 = Period.objects.create(start=datetime.date(2015, 8, 6), end=datetime.date(2015, 8, 7),
-                                     unit=u1, name='exceptionally short days', exception=True,
-                                     parent=p1)
-        Day.objects.create(period=exp1, weekday=3,
-                           opens=datetime.time(12, 0), closes=datetime.time(14, 0))
-        Day.objects.create(period=exp1, weekday=4,
-                           opens=datetime.time(12, 0), closes=datetime.time(14, 0))
-
-        # Weekend is closed as an exception
-        exp2 = Period.objects.create(start=datetime.date(2015, 8, 8), end=datetime.date(2015, 8, 9),
-                                     unit=u1, name='weekend is closed', closed=True, exception=True,
-                                     parent=p1)
-
-    def test_periods(self):
-        from resources.timetools import get_opening_hours
-        hours = get_opening_hours(datetime.date(2015, 8, 1), datetime.date(2015, 8, 10))
+import pytest
+
+from resources.models import Day, Period, Reservation, Resource, ResourceType, Unit
+from resources.models.utils import get_local_midnight, get_tz
+from resources.timetools import FreeTime, OpenHours, get_availability, get_opening_hours
+
+
+@pytest.fixture
+def unit_with_hours():
+    u1 = Unit.objects.create(name='Unit 1', id='unit_1', time_zone='Europe/Helsinki')
+    rt = ResourceType.objects.create(name='Type 1', id='type_1', main_type='space')
+    Resource.objects.create(name='Resource 1a', id='r1a', unit=u1, type=rt)
+    r1b = Resource.objects.create(name='Resource 1b', id='r1b', unit=u1, type=rt)
+
+    # Regular hours for one week
+    p1 = Period.objects.create(start=datetime.date(2015, 8, 3), end=datetime.date(2015, 8, 9),
+                               unit=u1, name='regular hours')
+    for weekday in range(0, 5):
+        Day.objects.create(period=p1, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
+    Day.objects.create(period=p1, weekday=5, opens=datetime.time(12, 0), closes=datetime.time(16, 0))
+    Day.objects.create(period=p1, weekday=6, opens=datetime.time(12, 0), closes=datetime.time(14, 0))
+
+    # Two shorter days as exception
+    exp1 = Period.objects.create(start=datetime.date(2015, 8, 6), end=datetime.date(2015, 8, 7),
+                                 unit=u1, name='exceptionally short days')
+    Day.objects.create(period=exp1, weekday=3, opens=datetime.time(12, 0), closes=datetime.time(14, 0))
+    Day.objects.create(period=exp1, weekday=4, opens=datetime.time(12, 0), closes=datetime.time(14, 0))
+
+    # Weekend is closed as an exception
+    Period.objects.create(start=datetime.date(2015, 8, 8), end=datetime.date(2015, 8, 9),
+                          unit=u1, name='weekend is closed')
+
+    # Resource 1b opens later on Monday
+    p2 = Period.objects.create(start=datetime.date(2015, 8, 3), end=datetime.date(2015, 8, 3),
+                               resource=r1b, name='late monday')
+    Day.objects.create(period=p2, weekday=0, opens=datetime.time(10, 0), closes=datetime.time(18, 0))
+
+    u1.update_opening_hours()
+    return u1
+
+
+def get_dt(tz, date, hour):
+    return tz.localize(datetime.datetime.combine(date, datetime.time(hour)))
+
+
+@pytest.mark.django_db
+def test_opening_hours(unit_with_hours, django_assert_num_queries):
+    tz = unit_with_hours.get_tz()
+    resources = Resource.objects.filter(unit=unit_with_hours).order_by('id')
+
+    with django_assert_num_queries(2):
+        hours = get_opening_hours(datetime.date(2015, 8, 1), datetime.date(2015, 8, 10), resources)
+
+    r1a, r1b = resources
+    assert list(hours[r1a]) == [datetime.date(2015, 8, day) for day in range(1, 11)]
+
+    def open_hours(date, opens, closes):
+        return [OpenHours(get_dt(tz, date, opens), get_dt(tz, date, closes))]
+
+    assert hours[r1a][datetime.date(2015, 8, 2)] == []
+    assert hours[r1a][datetime.date(2015, 8, 3)] == open_hours(datetime.date(2015, 8, 3), 8, 18)
+    assert hours[r1b][datetime.date(2015, 8, 3)] == open_hours(datetime.date(2015, 8, 3), 10, 18)
+    assert hours[r1a][datetime.date(2015, 8, 5)] == open_hours(datetime.date(2015, 8, 5), 8, 18)
+    assert hours[r1a][datetime.date(2015, 8, 6)] == open_hours(datetime.date(2015, 8, 6), 12, 14)
+    assert hours[r1b][datetime.date(2015, 8, 7)] == open_hours(datetime.date(2015, 8, 7), 12, 14)
+    assert hours[r1a][datetime.date(2015, 8, 8)] == []
+    assert hours[r1a][datetime.date(2015, 8, 9)] == []
+    assert hours[r1a][datetime.date(2015, 8, 10)] == []
+
+
+@pytest.mark.django_db
+def test_availability(unit_with_hours, user, django_assert_num_queries):
+    tz = unit_with_hours.get_tz()
+    r1a = Resource.objects.get(id='r1a')
+    monday = datetime.date(2015, 8, 3)
+    tuesday = datetime.date(2015, 8, 4)
+    Reservation.objects.create(resource=r1a, begin=get_dt(tz, monday, 10), end=get_dt(tz, monday, 11), user=user)
+    Reservation.objects.create(resource=r1a, begin=get_dt(tz, monday, 11), end=get_dt(tz, monday, 12), user=user)
+    Reservation.objects.create(resource=r1a, begin=get_dt(tz, monday, 17), end=get_dt(tz, tuesday, 9), user=user)
+    cancelled = Reservation.objects.create(resource=r1a, begin=get_dt(tz, tuesday, 12), end=get_dt(tz, tuesday, 13),
+                                           user=user)
+    cancelled.set_state(Reservation.CANCELLED, user)
+
+    resources = Resource.objects.filter(unit=unit_with_hours).order_by('id')
+    with django_assert_num_queries(3):
+        opening_hours, availability = get_availability(monday, tuesday, resources)
+
+    r1a, r1b = resources
+
+    def free_time(date, begin, end, end_date=None):
+        begin = get_dt(tz, date, begin)
+        end = get_dt(tz, end_date or date, end)
+        return FreeTime(begin, end, end - begin)
+
+    assert opening_hours[r1a][monday] == [OpenHours(get_dt(tz, monday, 8), get_dt(tz, monday, 18))]
+    assert availability[r1a][monday] == [free_time(monday, 8, 10), free_time(monday, 12, 17)]
+    assert availability[r1a][tuesday] == [free_time(tuesday, 9, 18)]
+    assert availability[r1b][monday] == [free_time(monday, 10, 18)]
+
+    _, availability = get_availability(monday, tuesday, resources, duration=datetime.timedelta(hours=6))
+    assert availability[r1a][monday] == []
+    assert availability[r1a][tuesday] == [free_time(tuesday, 9, 18)]
+    assert availability[r1b][monday] == [free_time(monday, 10, 18)]
+
+
+@pytest.mark.django_db
+def test_queries_do_not_grow_with_resources(unit_with_hours, django_assert_num_queries):
+    rt = ResourceType.objects.get(id='type_1')
+    for i in range(10):
+        Resource.objects.create(name='Resource %d' % i, id='r%d' % i, unit=unit_with_hours, type=rt)
+    unit_with_hours.update_opening_hours()
+
+    with django_assert_num_queries(3):
+        _, availability = get_availability(datetime.date(2015, 8, 1), datetime.date(2015, 8, 31))
+    assert len(availability) == 12
+
+
+def test_local_midnight():
+    tz = get_tz('Europe/Helsinki')
+    assert get_tz('Europe/Helsinki') is tz
+
+    # Daylight saving time started on this day
+    dst_start = datetime.date(2019, 3, 31)
+    midnight = get_local_midnight(tz, dst_start)
+    assert midnight == tz.localize(datetime.datetime.combine(dst_start, datetime.time(0, 0)))
+    assert get_local_midnight(tz, dst_start) is midnight
+    assert get_local_midnight(tz, dst_start + datetime.timedelta(days=1)) - midnight == datetime.timedelta(hours=23)
@@ -89,3 +89,28 @@ def test_typeahead_api_full_response(rf, typeahead_test_objects, typeahead_view)
     # Check that we get more data than with the non-full mode for resources:
     assert all(key in response_data["resource"][0] for key in ("id", "type", "name", "unit"))
     assert all(key in response_data["unit"][0] for key in ("id", "time_zone", "name", "phone"))
+
+
+@pytest.mark.django_db
+def test_typeahead_api_ranking_and_cache(rf, typeahead_test_objects, typeahead_view, space_resource_type):
+    meeting_room = typeahead_test_objects["meeting_room"]
+    big_room = Resource.objects.create(
+        unit=typeahead_test_objects["unit"], type=space_resource_type, authentication="none",
+        name="Konferenssihuone iso"
+    )
+
+    def get_resource_ids():
+        response = typeahead_view(request=rf.get("/", {"input": "konferenssi", "types": "resource"}))
+        response.render()
+        return [obj["id"] for obj in json.loads(force_text(response.content))["resource"]]
+
+    # The closest match comes first
+    assert get_resource_ids() == [meeting_room.id, big_room.id]
+
+    # Changes that send no signals are not seen until the cache expires
+    Resource.objects.filter(pk=big_room.pk).update(name_fi="Sauna")
+    assert get_resource_ids() == [meeting_room.id, big_room.id]
+
+    big_room.refresh_from_db()
+    big_room.save()
+    assert get_resource_ids() == [meeting_room.id]
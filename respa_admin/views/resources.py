@@ -1,9 +1,10 @@
 from django.conf import settings
 from django.contrib import messages
-from django.db.models import FieldDoesNotExist
+from django.db.models import FieldDoesNotExist, Max, Min
 from django.http import HttpResponseRedirect
 from django.template.response import TemplateResponse
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django.views.generic import CreateView, ListView
 from django.utils.translation import ugettext_lazy as _
 from respa_admin.views.base import ExtraContextMixin
@@ -203,6 +204,7 @@ class SaveResourceView(ExtraContextMixin, CreateView):
         return form
 
     def forms_valid(self, form, period_formset_with_days, resource_image_formset):
+        old_periods_date_range = self._get_periods_date_range() if self.object else None
         self.object = form.save()
 
         self._delete_extra_periods_days(period_formset_with_days)
@@ -212,7 +214,7 @@ class SaveResourceView(ExtraContextMixin, CreateView):
         self._save_resource_purposes()
         self._delete_extra_images(resource_image_formset)
         self._save_resource_images(resource_image_formset)
-        self.object.update_opening_hours()
+        self._update_opening_hours(form, old_periods_date_range)
 
         return HttpResponseRedirect(self.get_success_url())
 
@@ -280,6 +282,25 @@ class SaveResourceView(ExtraContextMixin, CreateView):
 
         ResourceImage.objects.filter(resource=self.object).exclude(pk__in=image_ids).delete()
 
+    def _get_periods_date_range(self):
+        dates = self.object.periods.aggregate(begin=Min('start'), end=Max('end'))
+        return dates['begin'], dates['end']
+
+    def _update_opening_hours(self, form, old_periods_date_range):
+        if old_periods_date_range is None or 'unit' in form.changed_data:
+            self.object.update_opening_hours()
+            return
+
+        # Only the dates covered by the resource's own periods before or
+        # after the save can have changed. Without periods of its own the
+        # resource follows its unit, and its hours are brought up to date
+        # with the unit's from today on.
+        dates = [date for date in old_periods_date_range + self._get_periods_date_range() if date]
+        if dates:
+            self.object.update_opening_hours(min(dates), max(dates))
+        else:
+            self.object.update_opening_hours(timezone.now().astimezone(self.object.get_tz()).date())
+
     def _delete_extra_periods_days(self, period_formset_with_days):
         data = period_formset_with_days.data
         period_ids = get_formset_ids('periods', data)
@@ -6,10 +6,11 @@ import logging
 import iso8601
 
 from lxml import etree
+from django.db import IntegrityError
 from django.db.transaction import atomic
 from django.utils.timezone import now
 
-from resources.models.reservation import Reservation
+from resources.models.reservation import Reservation, is_reservation_overlap_error
 from respa_exchange.ews.calendar import GetCalendarItemsRequest, FindCalendarItemsRequest
 from respa_exchange.ews.user import ResolveNamesRequest
 from respa_exchange.ews.objs import ItemID
@@ -171,26 +172,13 @@ def fetch_reservation_data(ex_reservation):
     return str(etree.tostring(items[0], pretty_print=True), encoding='utf8')
 
 
-@atomic
-def sync_from_exchange(ex_resource, future_days=365, no_op=False):
+def _fetch_calendar_items(ex_resource, start_date, end_date):
     """
-    Synchronize from Exchange to Respa
+    Fetch the calendar items of an Exchange resource between the given dates
 
-    Synchronizes current and future events for the given Exchange resource into
-    the relevant Respa resource as reservations.
-
-    :param ex_resource: The Exchange resource to sync
     :type ex_resource: respa_exchange.models.ExchangeResource
-    :param future_days: How many days into the future to look
-    :type future_days: int
-    :param no_op: If True, do not save the reservations
-    :type no_op: bool
+    :rtype: dict[ItemID, lxml.etree.Element]
     """
-    if not ex_resource.sync_to_respa and not no_op:
-        return
-    start_date = now().replace(hour=0, minute=0, second=0)
-    end_date = start_date + datetime.timedelta(days=future_days)
-
     log.info(
         "%s: Requesting items between (%s..%s)",
         ex_resource.principal_email,
@@ -207,18 +195,21 @@ def sync_from_exchange(ex_resource, future_days=365, no_op=False):
     for item in gcir.send(session):
         calendar_items[ItemID.from_tree(item)] = item
 
-    hashes = set(item_id.hash for item_id in calendar_items.keys())
-
     log.info(
         "%s: Received %d items",
         ex_resource.principal_email,
         len(calendar_items)
     )
+    return calendar_items
 
-    if no_op:
-        return
 
-    # First handle deletions . . .
+def _delete_removed_reservations(ex_resource, hashes, start_date, end_date):
+    """
+    Delete the downloaded reservations whose Exchange items no longer exist
+
+    :type ex_resource: respa_exchange.models.ExchangeResource
+    :type hashes: set[str]
+    """
     items_to_delete = ExchangeReservation.objects.select_related("reservation").filter(
         managed_in_exchange=True,  # Reservations we've downloaded ...
         reservation__begin__gte=start_date,  # that are in ...
@@ -232,6 +223,66 @@ def sync_from_exchange(ex_resource, future_days=365, no_op=False):
         ex_reservation.delete()
         reservation.delete()
 
+
+def _save_calendar_item(ex_resource, item_id, item, ex_reservation):
+    """
+    Create or update the reservation of an Exchange calendar item
+
+    Items overlapping existing reservations are skipped with a warning.
+
+    :type ex_resource: respa_exchange.models.ExchangeResource
+    :type item_id: ItemID
+    :type ex_reservation: respa_exchange.models.ExchangeReservation | None
+    """
+    item_props = _parse_item_props(ex_resource, item_id, item)
+    try:
+        with atomic():
+            if not ex_reservation:  # It's a new one!
+                _create_reservation_from_exchange(item_id, ex_resource, item_props)
+            elif ex_reservation._change_key != item_id.change_key:
+                # Things changed, so edit the reservation
+                _update_reservation_from_exchange(item_id, ex_reservation, ex_resource, item_props)
+    except IntegrityError as exc:
+        if not is_reservation_overlap_error(exc):
+            raise
+        log.warning(
+            "%s: skipping item %s (%s..%s) overlapping an existing reservation",
+            ex_resource.principal_email,
+            item_id.hash,
+            item_props["start"],
+            item_props["end"]
+        )
+
+
+@atomic
+def sync_from_exchange(ex_resource, future_days=365, no_op=False):
+    """
+    Synchronize from Exchange to Respa
+
+    Synchronizes current and future events for the given Exchange resource into
+    the relevant Respa resource as reservations.
+
+    :param ex_resource: The Exchange resource to sync
+    :type ex_resource: respa_exchange.models.ExchangeResource
+    :param future_days: How many days into the future to look
+    :type future_days: int
+    :param no_op: If True, do not save the reservations
+    :type no_op: bool
+    """
+    if not ex_resource.sync_to_respa and not no_op:
+        return
+    start_date = now().replace(hour=0, minute=0, second=0)
+    end_date = start_date + datetime.timedelta(days=future_days)
+
+    calendar_items = _fetch_calendar_items(ex_resource, start_date, end_date)
+    hashes = set(item_id.hash for item_id in calendar_items.keys())
+
+    if no_op:
+        return
+
+    # First handle deletions . . .
+    _delete_removed_reservations(ex_resource, hashes, start_date, end_date)
+
     # And then creations/additions
 
     extant_exchange_reservations = {
@@ -241,14 +292,6 @@ def sync_from_exchange(ex_resource, future_days=365, no_op=False):
     }
 
     for item_id, item in calendar_items.items():
-        ex_reservation = extant_exchange_reservations.get(item_id.hash)
-        item_props = _parse_item_props(ex_resource, item_id, item)
-
-        if not ex_reservation:  # It's a new one!
-            ex_reservation = _create_reservation_from_exchange(item_id, ex_resource, item_props)
-        else:
-            if ex_reservation._change_key != item_id.change_key:
-                # Things changed, so edit the reservation
-                _update_reservation_from_exchange(item_id, ex_reservation, ex_resource, item_props)
+        _save_calendar_item(ex_resource, item_id, item, extant_exchange_reservations.get(item_id.hash))
 
     log.info("%s: download processing complete", ex_resource.principal_email)